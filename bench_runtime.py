@@ -0,0 +1,157 @@
+import ast
+import json
+import statistics
+import subprocess
+import sys
+import time
+from budget import ExecutionBudget, instrument
+from runtime import PythonRuntime, preload_modules
+from scheduler import ExecutionScheduler
+from serialization import JSON, compress, encode_execute_result
+
+IMPORT_MODULES = ['math', 'itertools', 'statistics', 'json', 'collections', 'datetime', 'fractions']
+IMPORT_BLOCK = "\n".join(f"import {name}" for name in IMPORT_MODULES)
+
+def bench_cold_imports(repeat=5):
+    # Fresh interpreter per run: what every session paid before modules were shared
+    script = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        f"{IMPORT_BLOCK}\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    timings = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+        timings.append(float(out.stdout))
+    return min(timings)
+
+def bench_session_imports(sessions=200):
+    preload_modules(IMPORT_MODULES)
+    total = 0.0
+    for _ in range(sessions):
+        runtime = PythonRuntime()
+        start = time.perf_counter()
+        result = runtime.execute(IMPORT_BLOCK)
+        total += time.perf_counter() - start
+        assert result == "", result
+        runtime.terminate()
+    return total / sessions
+
+def _spin(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+def bench_light_latency(fair, heavy_jobs=40, light_jobs=40):
+    # A heavy tenant floods the queue with 20ms jobs while a light tenant sends 1ms jobs
+    scheduler = ExecutionScheduler(max_queued=0)
+    scheduler.start()
+    heavy_tenant = "heavy" if fair else "shared"
+    light_tenant = "light" if fair else "shared"
+    session = None if fair else "shared"
+    heavy = [
+        scheduler.submit(lambda: _spin(0.02), tenant_id=heavy_tenant, session_id=session or f"heavy-{i}")
+        for i in range(heavy_jobs)
+    ]
+    latencies = []
+    for i in range(light_jobs):
+        start = time.perf_counter()
+        scheduler.submit(lambda: _spin(0.001), tenant_id=light_tenant, session_id=session or "light").result()
+        latencies.append(time.perf_counter() - start)
+    for future in heavy:
+        future.result()
+    scheduler.stop()
+    return statistics.quantiles(latencies, n=100)[98]
+
+BUDGET_WORKLOAD = '''
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+total = 0
+for i in range(200000):
+    total += i % 7
+result = fib(20)
+squares = [x * x for x in range(100000)]
+'''
+
+def bench_budget_overhead(trials=15, repeat=5):
+    # Same workload compiled plain and with budget checks at loop back-edges and calls.
+    # The overhead varies a lot between runs, so each trial times both versions back
+    # to back and the caller reports the spread rather than a single figure
+    plain = compile(ast.parse(BUDGET_WORKLOAD), '<bench>', 'exec')
+    checked = compile(instrument(ast.parse(BUDGET_WORKLOAD)), '<bench>', 'exec')
+
+    def run(code, with_budget):
+        best = float('inf')
+        for _ in range(repeat):
+            namespace = {}
+            if with_budget:
+                ExecutionBudget(10 ** 9).install(namespace)
+            start = time.perf_counter()
+            exec(code, namespace)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    return [(run(plain, False), run(checked, True)) for _ in range(trials)]
+
+SERIALIZATION_SETUP = '''
+rows = [{"id": i, "name": "row" + str(i), "score": i * 0.5, "tags": ["a", "b"]} for i in range(20000)]
+totals = {str(i): i * i for i in range(5000)}
+label = "report"
+'''
+
+def bench_serialization(repeat=20):
+    runtime = PythonRuntime()
+    runtime.execute(SERIALIZATION_SETUP)
+
+    def default_path():
+        # Previous path: json.dumps per value to test it, then a second full encode of the response
+        return json.dumps({"output": "", "variables": runtime.get_variables()}).encode()
+
+    def fast_path():
+        return encode_execute_result("", runtime.get_encoded_variables(JSON), JSON)
+
+    def timed(func):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.process_time()
+            body = func()
+            best = min(best, time.process_time() - start)
+        return best, body
+
+    default_time, default_body = timed(default_path)
+    fast_time, fast_body = timed(fast_path)
+    compressed, _ = compress(fast_body, "gzip")
+    runtime.terminate()
+    return default_time, len(default_body), fast_time, len(fast_body), len(compressed)
+
+def main():
+    cold = bench_cold_imports()
+    shared = bench_session_imports()
+    print(f"Imports: {', '.join(IMPORT_MODULES)}")
+    print(f"  cold import per session:   {cold * 1000:8.3f} ms")
+    print(f"  shared import per session: {shared * 1000:8.3f} ms")
+    print(f"  speedup:                   {cold / shared:8.1f}x")
+
+    fifo = bench_light_latency(fair=False)
+    fair = bench_light_latency(fair=True)
+    print("Light tenant p99 latency while a heavy tenant floods the queue")
+    print(f"  single FIFO flow:          {fifo * 1000:8.3f} ms")
+    print(f"  weighted fair queueing:    {fair * 1000:8.3f} ms")
+
+    trials = bench_budget_overhead()
+    overheads = sorted((checked / plain - 1) * 100 for plain, checked in trials)
+    print(f"Execution budget instrumentation ({len(trials)} trials, best of 5 runs each)")
+    print(f"  uninstrumented (median):   {statistics.median(p for p, _ in trials) * 1000:8.3f} ms")
+    print(f"  instrumented (median):     {statistics.median(c for _, c in trials) * 1000:8.3f} ms")
+    print(f"  overhead min/median/max:   {overheads[0]:5.1f} / {statistics.median(overheads):5.1f} / {overheads[-1]:5.1f} %")
+
+    default_time, default_bytes, fast_time, fast_bytes, gzip_bytes = bench_serialization()
+    print("Execute response serialization")
+    print(f"  default encode (2x json):  {default_time * 1000:8.3f} ms  {default_bytes:9d} bytes")
+    print(f"  single encode:             {fast_time * 1000:8.3f} ms  {fast_bytes:9d} bytes")
+    print(f"  single encode + gzip:                  {gzip_bytes:9d} bytes")
+
+if __name__ == "__main__":
+    main()
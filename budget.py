@@ -0,0 +1,141 @@
+import ast
+import itertools
+from operator import itemgetter
+
+# Name injected into the sandbox namespace; user code may not reference it
+TICK_NAME = '__budget_tick__'
+RESERVED_PREFIX = '__budget'
+
+class BudgetExceeded(Exception):
+    pass
+
+class ExecutionBudget:
+    """Step counter shared by every check inserted into one execution.
+
+    The tick is the __next__ of a range iterator, so a check is a single C call
+    with no Python frame. Ticks return truthy values until the budget runs out,
+    then raise StopIteration. User code can swallow or translate that exception
+    (generators turn it into RuntimeError), so the runtime decides from
+    `exceeded` rather than from the exception type.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.reason = None
+        # One spare value: using it means the budget was exceeded, even if the
+        # code finished before the next check got to raise
+        self._remaining = iter(range(steps + 1, 0, -1))
+        self.tick = self._remaining.__next__
+
+    @property
+    def exceeded(self):
+        return self._remaining.__length_hint__() == 0
+
+    def install(self, namespace):
+        namespace[TICK_NAME] = self.tick
+
+    def check(self):
+        if self.exceeded:
+            raise BudgetExceeded(self.reason or f"Execution budget of {self.steps} steps exceeded")
+
+    def exhaust(self, reason):
+        """Spend the rest of the budget so the next check stops the execution.
+
+        Safe to call from a signal handler while the execution runs.
+        """
+        self.reason = reason
+        self._remaining.__setstate__(self.steps + 1)
+
+    def meter(self, iterable):
+        """Iterate over iterable, spending one step per item.
+
+        For builtins such as sum() that loop in C, where no inserted check runs.
+        Stays in C per item: zip() stops once the budget runs out, and the
+        trailing iterator then raises BudgetExceeded.
+        """
+        return itertools.chain(map(itemgetter(0), zip(iterable, self._remaining)), _MeterEnd(self))
+
+class _MeterEnd:
+    def __init__(self, budget):
+        self.budget = budget
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.budget.check()
+        raise StopIteration
+
+def _tick():
+    return ast.Call(func=ast.Name(id=TICK_NAME, ctx=ast.Load()), args=[], keywords=[])
+
+def _check(node):
+    # `if __budget_tick__(): pass` rather than a bare call, which 'single'
+    # mode compilation would echo like any other expression statement
+    return ast.copy_location(ast.If(test=_tick(), body=[ast.Pass()], orelse=[]), node)
+
+def _has_docstring(body):
+    return body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+        and isinstance(body[0].value.value, str)
+
+class BudgetInstrumenter(ast.NodeTransformer):
+    """Insert budget checks at loop back-edges and function entries.
+
+    Loops and functions get a `__budget_tick__()` check at the top of their
+    body. Comprehensions get it as their first filter and lambdas evaluate it
+    before their body, since neither can hold statements.
+    """
+
+    def _instrument_loop(self, node):
+        self.generic_visit(node)
+        node.body = [_check(node)] + node.body
+        return node
+
+    visit_For = _instrument_loop
+    visit_AsyncFor = _instrument_loop
+    visit_While = _instrument_loop
+
+    def visit_FunctionDef(self, node):
+        self.generic_visit(node)
+        docstring = node.body[:1] if _has_docstring(node.body) else []
+        node.body = docstring + [_check(node)] + node.body[len(docstring):]
+        return node
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self.generic_visit(node)
+        # lambda args: (__budget_tick__(), body)[1]
+        node.body = ast.copy_location(ast.Subscript(
+            value=ast.Tuple(elts=[_tick(), node.body], ctx=ast.Load()),
+            slice=ast.Constant(value=1),
+            ctx=ast.Load()
+        ), node.body)
+        return node
+
+    def visit_comprehension(self, node):
+        self.generic_visit(node)
+        node.ifs = [_tick()] + node.ifs
+        return node
+
+def validate_names(tree):
+    """Raise ValueError if code refers to the instrumentation names."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            names = [node.id]
+        elif isinstance(node, ast.arg):
+            names = [node.arg]
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names = node.names
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names = [node.name]
+        else:
+            continue
+        for name in names:
+            if name.startswith(RESERVED_PREFIX):
+                raise ValueError(f"Reserved name: {name}")
+
+def instrument(tree):
+    """Rewrite a parsed module in place with budget checks and return it."""
+    tree = BudgetInstrumenter().visit(tree)
+    return ast.fix_missing_locations(tree)
@@ -0,0 +1,357 @@
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Set on forwarded requests so a misrouted request is never bounced twice
+FORWARDED_HEADER = "X-OllaRuntime-Forwarded"
+
+class HashRing:
+    """Consistent-hash ring mapping session ids to worker ids."""
+
+    def __init__(self, nodes=(), virtual_nodes=64):
+        self.virtual_nodes = virtual_nodes
+        self.nodes = set()
+        self._keys = []
+        self._owners = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.virtual_nodes):
+            point = self._hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._keys, point)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        for i in range(self.virtual_nodes):
+            point = self._hash(f"{node}#{i}")
+            del self._owners[point]
+            del self._keys[bisect.bisect_left(self._keys, point)]
+
+    def get(self, key):
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._owners[self._keys[index]]
+
+class Registry:
+    """Shared record of live workers and which worker owns each session.
+
+    Every worker of a cluster must use the same backend. SessionRegistry
+    covers workers on one machine; spreading workers over several machines
+    takes a backend they can all reach, e.g. a database or key-value store,
+    implementing these methods with the same guarantees.
+    """
+
+    def heartbeat(self, worker_id, address):
+        """Record that worker_id is alive and reachable at address (host:port)."""
+        raise NotImplementedError
+
+    def remove_worker(self, worker_id):
+        """Drop a worker and every session it owns."""
+        raise NotImplementedError
+
+    def live_workers(self, timeout):
+        """Return {worker_id: address} of workers seen within the last timeout seconds."""
+        raise NotImplementedError
+
+    def get_owner(self, session_id):
+        """Return the worker id owning the session, or None."""
+        raise NotImplementedError
+
+    def claim(self, session_id, worker_id, previous_owner=None):
+        """Atomically hand the session to worker_id if its owner is still previous_owner.
+
+        Returns the owner after the attempt, which is another worker's id if
+        that worker claimed it first.
+        """
+        raise NotImplementedError
+
+    def release(self, session_id, worker_id):
+        """Drop the session's ownership if worker_id still holds it."""
+        raise NotImplementedError
+
+    def release_orphans(self, live_worker_ids):
+        """Atomically drop sessions owned by workers not in live_worker_ids; returns their ids."""
+        raise NotImplementedError
+
+class SessionRegistry(Registry):
+    """Registry backed by SQLite, so workers on one machine coordinate without an external service.
+
+    WAL mode relies on shared memory, so the file must be on a local disk and
+    is not safe to share across machines.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers ("
+                "worker_id TEXT PRIMARY KEY, address TEXT NOT NULL, last_seen REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, worker_id TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def heartbeat(self, worker_id, address):
+        self._execute(
+            "INSERT INTO workers (worker_id, address, last_seen) VALUES (?, ?, ?) "
+            "ON CONFLICT(worker_id) DO UPDATE SET address = excluded.address, last_seen = excluded.last_seen",
+            (worker_id, address, time.time()),
+        )
+
+    def remove_worker(self, worker_id):
+        self._execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+        self._execute("DELETE FROM sessions WHERE worker_id = ?", (worker_id,))
+
+    def live_workers(self, timeout):
+        rows = self._execute(
+            "SELECT worker_id, address FROM workers WHERE last_seen >= ?",
+            (time.time() - timeout,),
+        )
+        return dict(rows)
+
+    def get_owner(self, session_id):
+        rows = self._execute("SELECT worker_id FROM sessions WHERE session_id = ?", (session_id,))
+        return rows[0][0] if rows else None
+
+    def claim(self, session_id, worker_id, previous_owner=None):
+        # Compare-and-set, so concurrent workers agree on a single owner
+        if previous_owner is None:
+            self._execute(
+                "INSERT OR IGNORE INTO sessions (session_id, worker_id, created_at) VALUES (?, ?, ?)",
+                (session_id, worker_id, time.time()),
+            )
+        else:
+            self._execute(
+                "UPDATE sessions SET worker_id = ? WHERE session_id = ? AND worker_id = ?",
+                (worker_id, session_id, previous_owner),
+            )
+        return self.get_owner(session_id)
+
+    def release(self, session_id, worker_id):
+        self._execute("DELETE FROM sessions WHERE session_id = ? AND worker_id = ?", (session_id, worker_id))
+
+    def release_orphans(self, live_worker_ids):
+        placeholders = ", ".join("?" for _ in live_worker_ids)
+        where = f"WHERE worker_id NOT IN ({placeholders})"
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(f"SELECT session_id FROM sessions {where}", tuple(live_worker_ids)).fetchall()
+                self._conn.execute(f"DELETE FROM sessions {where}", tuple(live_worker_ids))
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [row[0] for row in rows]
+
+class ClusterNode:
+    """This worker's view of the cluster: membership, routing and forwarding.
+
+    Used from the heartbeat thread and from request handlers' worker threads,
+    so membership, the ring and local_sessions only change under one lock.
+    on_release is called with that lock held and must not block; hand the
+    work to the thread that owns the sessions.
+    """
+
+    def __init__(self, registry, worker_id, address, heartbeat_interval=5,
+                 worker_timeout=15, virtual_nodes=64, forward_timeout=30, on_release=None):
+        self.registry = registry
+        self.worker_id = worker_id
+        self.address = address
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_timeout = worker_timeout
+        self.forward_timeout = forward_timeout
+        self.on_release = on_release
+        self.ring = HashRing(virtual_nodes=virtual_nodes)
+        self.workers = {}
+        self.local_sessions = set()
+        # Workers this node failed to connect to -> when, skipped for worker_timeout
+        self._unreachable = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, on_release=None, registry=None):
+        """Build this worker's node; registry defaults to the SQLite one at cluster.registry_path."""
+        host = config.get("cluster", "advertise_host", "127.0.0.1")
+        port = int(config.get("cluster", "advertise_port") or config.get("app", "port", 8000))
+        address = f"{host}:{port}"
+        if registry is None:
+            registry = SessionRegistry(config.get("cluster", "registry_path", "ollaruntime_registry.db"))
+        return cls(
+            registry,
+            worker_id=address,
+            address=address,
+            heartbeat_interval=float(config.get("cluster", "heartbeat_interval", 5)),
+            worker_timeout=float(config.get("cluster", "worker_timeout", 15)),
+            virtual_nodes=int(config.get("cluster", "virtual_nodes", 64)),
+            forward_timeout=float(config.get("cluster", "forward_timeout", 30)),
+            on_release=on_release,
+        )
+
+    def start(self):
+        self.registry.heartbeat(self.worker_id, self.address)
+        self.refresh()
+        self._thread = threading.Thread(target=self._heartbeat_loop, name="cluster-heartbeat", daemon=True)
+        self._thread.start()
+        logger.info(f"Cluster worker {self.worker_id} joined ({len(self.workers)} live workers)")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.heartbeat_interval)
+        self.registry.remove_worker(self.worker_id)
+        logger.info(f"Cluster worker {self.worker_id} left")
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.registry.heartbeat(self.worker_id, self.address)
+                self.refresh()
+            except sqlite3.Error as e:
+                logger.error(f"Cluster heartbeat failed: {str(e)}")
+
+    def refresh(self):
+        with self._lock:
+            workers = self.registry.live_workers(self.worker_timeout)
+            now = time.monotonic()
+            for worker_id, since in list(self._unreachable.items()):
+                if now - since >= self.worker_timeout:
+                    del self._unreachable[worker_id]
+                else:
+                    workers.pop(worker_id, None)
+            workers[self.worker_id] = self.address
+            if set(workers) != self.ring.nodes:
+                self._rebalance(workers)
+            self.workers = workers
+
+    def _rebalance(self, workers):
+        joined = set(workers) - self.ring.nodes
+        left = self.ring.nodes - set(workers)
+        for worker_id in joined:
+            self.ring.add(worker_id)
+        for worker_id in left:
+            self.ring.remove(worker_id)
+        # Sessions of departed workers are re-homed by the ring on their next request.
+        # Sessions on live workers stay put so their in-memory state survives a join.
+        orphans = self.registry.release_orphans(list(workers)) if left else []
+        logger.info(
+            f"Cluster rebalanced: joined={sorted(joined)} left={sorted(left)} released_sessions={len(orphans)}"
+        )
+        for session_id in list(self.local_sessions):
+            if self.registry.get_owner(session_id) not in (None, self.worker_id):
+                self._release(session_id)
+
+    def _release(self, session_id):
+        self.local_sessions.discard(session_id)
+        if self.on_release is not None:
+            self.on_release(session_id)
+
+    def mark_unreachable(self, worker_id):
+        """Route around a worker that refused a connection, even if its heartbeat looks recent."""
+        if worker_id == self.worker_id:
+            return
+        with self._lock:
+            self._unreachable[worker_id] = time.monotonic()
+            self.refresh()
+
+    def is_peer(self, worker_id, client_host):
+        """Whether a request claiming to be forwarded by worker_id came from that worker's host."""
+        with self._lock:
+            if worker_id not in self.workers:
+                self.refresh()
+            address = self.workers.get(worker_id)
+        return worker_id != self.worker_id and address is not None and address.rpartition(":")[0] == client_host
+
+    def forget(self, session_id):
+        """Drop ownership of a session this worker evicted."""
+        with self._lock:
+            self.local_sessions.discard(session_id)
+            self.registry.release(session_id, self.worker_id)
+
+    def route(self, session_id):
+        """Return (worker_id, address) of the worker that owns the session.
+
+        Queries the registry; call it off the event loop.
+        """
+        with self._lock:
+            owner = self.registry.get_owner(session_id)
+            if owner is not None and owner not in self.workers:
+                self.refresh()
+            if owner is None or owner not in self.workers:
+                owner = self.registry.claim(session_id, self.ring.get(session_id), previous_owner=owner)
+            if owner == self.worker_id:
+                self.local_sessions.add(session_id)
+            elif session_id in self.local_sessions:
+                self._release(session_id)
+            return owner, self.workers.get(owner)
+
+    def forward(self, address, path, body, headers):
+        """Replay a request on the owning worker; returns (status, headers, body).
+
+        Raises urllib.error.URLError if the worker cannot be reached and
+        TimeoutError if it accepted the request but did not answer in time.
+        """
+        headers = dict(headers)
+        headers[FORWARDED_HEADER] = self.worker_id
+        forwarded = urllib.request.Request(f"http://{address}{path}", data=body, headers=headers, method="POST")
+        try:
+            with urllib.request.urlopen(forwarded, timeout=self.forward_timeout) as response:
+                return response.status, self._relay_headers(response.headers), response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, self._relay_headers(e.headers), e.read()
+
+    @staticmethod
+    def _relay_headers(headers):
+        # The body is passed through untouched, so its encoding headers must be too
+        return {name: headers[name] for name in ("Content-Type", "Content-Encoding", "Vary", "Retry-After")
+                if name in headers}
+
+def _serve_worker(app_path, host, port, log_level):
+    config.update("cluster", "advertise_port", port)
+    import uvicorn
+    uvicorn.run(app_path, host=host, port=port, log_level=log_level)
+
+def run_workers(app_path, workers, host, port, log_level="info"):
+    """Run one uvicorn process per worker on consecutive ports, all sharing the registry."""
+    processes = [
+        multiprocessing.Process(target=_serve_worker, args=(app_path, host, port + i, log_level), daemon=False)
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
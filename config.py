@@ -1,3 +1,4 @@
+import json
 import os
 from typing import Dict, Any
 
@@ -22,6 +23,17 @@ class Config:
                     'repr', 'round', 'set', 'slice', 'sorted', 'str', 'sum',
                     'tuple', 'type', 'zip'
                 ],
+                # Modules sandboxed code may import; pre-imported once per worker.
+                # Entries match exactly, so submodules are listed one by one.
+                # Never add modules that read attributes by name (operator,
+                # string.Formatter), evaluate annotations (functools) or reach
+                # the file system (numpy): each one is a way out of the sandbox.
+                # decimal is left out as its DefaultContext is shared by every
+                # session on the worker
+                "allowed_imports": [
+                    'math', 'cmath', 'itertools', 'statistics', 'json',
+                    'collections', 'datetime', 'random', 'fractions'
+                ],
                 "restricted_operations": [
                     r'import\s+os',
                     r'import\s+sys',
@@ -49,7 +61,42 @@ class Config:
             "limits": {
                 "max_code_length": 10000,
                 "max_variables": 100,
-                "max_nesting_depth": 10
+                "max_nesting_depth": 10,
+                # Loop iterations plus function calls per execution, 0 disables the budget
+                "max_execution_steps": 10_000_000,
+                # Executed blocks remembered per session for re-running dependents
+                "max_history_blocks": 200,
+                # Sessions kept per worker; the least recently used is evicted first, 0 = unlimited
+                "max_sessions": 1000,
+                "session_idle_timeout": 3600  # seconds, 0 keeps idle sessions
+            },
+            "cluster": {
+                "enabled": False,
+                "workers": 1,  # uvicorn processes started on consecutive ports
+                "registry_path": "ollaruntime_registry.db",
+                "advertise_host": "127.0.0.1",
+                "advertise_port": None,  # defaults to app.port
+                "heartbeat_interval": 5,  # seconds
+                "worker_timeout": 15,  # seconds without heartbeat before a worker is dropped
+                "virtual_nodes": 64,
+                "forward_timeout": 30  # seconds
+            },
+            "scheduler": {
+                "lanes": ["interactive", "batch"],  # served in priority order
+                "default_lane": "batch",
+                "tenant_weights": {},  # tenant id -> share of CPU time
+                "default_weight": 1,
+                "cpu_quota": 0,  # CPU seconds per tenant per window, 0 = unlimited
+                "quota_window": 60,  # seconds
+                "max_queued": 100,  # pending executions per tenant
+                # Client hosts allowed to set tenant_id and lane. Others are accounted as
+                # one tenant per address and always use default_lane
+                "trusted_clients": ["127.0.0.1", "::1"]
+            },
+            "serialization": {
+                "compression_threshold": 1024,  # bytes; smaller responses are sent as is
+                "gzip_level": 6,
+                "zstd_level": 3
             }
         }
 
@@ -71,6 +118,21 @@ class Config:
             for key in keys:
                 env_var = f"{section.upper()}_{key.upper()}"
                 if env_var in os.environ:
-                    self.settings[section][key] = os.environ[env_var]
+                    self.settings[section][key] = self._coerce(keys[key], os.environ[env_var])
+
+    @staticmethod
+    def _coerce(default: Any, value: str):
+        # Environment values are strings; match the type of the default
+        if isinstance(default, bool):
+            return value.strip().lower() in ("1", "true", "yes", "on")
+        if isinstance(default, int):
+            return int(value)
+        if isinstance(default, float):
+            return float(value)
+        if isinstance(default, dict):
+            return json.loads(value)
+        if isinstance(default, list):
+            return [item.strip() for item in value.split(",") if item.strip()]
+        return value
 
 config = Config()
\ No newline at end of file
@@ -0,0 +1,163 @@
+import ast
+import itertools
+
+class _ScopeVisitor(ast.NodeVisitor):
+    """Collect the names one scope reads and binds.
+
+    Names read by nested functions, lambdas, classes and comprehensions count
+    as reads of the enclosing scope unless the nested scope binds them itself.
+    """
+
+    def __init__(self):
+        self.loads = set()
+        self.stores = set()
+        self.globals = set()
+        self.global_stores = set()  # Module names bound from nested scopes via `global`
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.loads.add(node.id)
+        else:
+            self.stores.add(node.id)
+
+    def visit_AugAssign(self, node):
+        if isinstance(node.target, ast.Name):
+            self.loads.add(node.target.id)
+        self.generic_visit(node)
+
+    def visit_Global(self, node):
+        self.globals.update(node.names)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.stores.add(alias.asname or alias.name.partition('.')[0])
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            if alias.name != '*':
+                self.stores.add(alias.asname or alias.name)
+
+    def _visit_all(self, nodes):
+        for node in nodes:
+            if node is not None:
+                self.visit(node)
+
+    def _nested(self, params, body):
+        child = _ScopeVisitor()
+        child.stores.update(params)
+        child._visit_all(body)
+        local = child.stores - child.globals
+        self.loads |= child.loads - local
+        self.global_stores |= (child.stores & child.globals) | child.global_stores
+
+    @staticmethod
+    def _params(args):
+        params = args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]
+        return [arg.arg for arg in params if arg is not None]
+
+    def _visit_signature(self, args):
+        # Defaults and annotations are evaluated in the enclosing scope
+        self._visit_all(args.defaults + args.kw_defaults)
+        for arg in args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]:
+            if arg is not None:
+                self._visit_all([arg.annotation])
+
+    def visit_FunctionDef(self, node):
+        self._visit_all(node.decorator_list + [node.returns])
+        self._visit_signature(node.args)
+        self.stores.add(node.name)
+        self._nested(self._params(node.args), node.body)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self._visit_signature(node.args)
+        self._nested(self._params(node.args), [node.body])
+
+    def visit_ClassDef(self, node):
+        self._visit_all(node.decorator_list + node.bases + [keyword.value for keyword in node.keywords])
+        self.stores.add(node.name)
+        self._nested([], node.body)
+
+    def _visit_comprehension(self, node, elements):
+        # Only the first iterable is evaluated in the enclosing scope
+        generators = node.generators
+        self.visit(generators[0].iter)
+        child = _ScopeVisitor()
+        for index, generator in enumerate(generators):
+            if index:
+                child.visit(generator.iter)
+            child.visit(generator.target)
+            child._visit_all(generator.ifs)
+        child._visit_all(elements)
+        self.loads |= child.loads - child.stores
+        self.global_stores |= child.global_stores
+
+    def visit_ListComp(self, node):
+        self._visit_comprehension(node, [node.elt])
+
+    visit_SetComp = visit_ListComp
+    visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self._visit_comprehension(node, [node.key, node.value])
+
+def analyze(tree):
+    """Return (defines, uses) for a parsed block.
+
+    Uses are the names the block reads before binding them itself, i.e. the
+    values it takes from blocks executed earlier. The analysis is static and
+    errs towards more uses, which only costs extra re-runs.
+    """
+    defines, uses = set(), set()
+    for stmt in tree.body:
+        visitor = _ScopeVisitor()
+        visitor.visit(stmt)
+        uses |= visitor.loads - defines
+        defines |= visitor.stores | visitor.global_stores
+    return frozenset(defines), frozenset(uses)
+
+class Block:
+    __slots__ = ('id', 'source', 'defines', 'uses')
+
+    def __init__(self, block_id, source, defines, uses):
+        self.id = block_id
+        self.source = source
+        self.defines = defines
+        self.uses = uses
+
+class DependencyGraph:
+    """Def/use history of the blocks executed in one session, in program order.
+
+    A block whose names were all defined by earlier blocks that define nothing
+    else is an edit of them: it takes the place of the earliest and drops the
+    rest. Otherwise it goes right after the last earlier block defining any of
+    its names, so the newest block is always the last writer of the names it
+    defines. Every block after it in the history is downstream of it.
+    """
+
+    def __init__(self, max_blocks=200):
+        self.max_blocks = max_blocks
+        self.blocks = []
+        self._ids = itertools.count(1)
+
+    def add(self, source, defines, uses):
+        block = Block(next(self._ids), source, defines, uses)
+        definers = [other for other in self.blocks if other.defines & defines]
+        if not definers:
+            position = len(self.blocks)
+        elif all(other.defines <= defines for other in definers):
+            position = self.blocks.index(definers[0])
+            self.blocks = [other for other in self.blocks if other not in definers]
+        else:
+            # Blocks defining more than this one keep running first
+            position = self.blocks.index(definers[-1]) + 1
+        self.blocks.insert(position, block)
+        if len(self.blocks) > self.max_blocks:
+            del self.blocks[:len(self.blocks) - self.max_blocks]
+        return block
+
+    def downstream(self, block):
+        if block not in self.blocks:
+            return []
+        return self.blocks[self.blocks.index(block) + 1:]
@@ -1,16 +1,29 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pydantic import BaseModel, Field
 from runtime import PythonRuntime
 from parser import CodeParser
+from cluster import ClusterNode, FORWARDED_HEADER, run_workers
+from scheduler import ExecutionScheduler, QuotaExceeded, SchedulerError
+from serialization import compress, encode_execute_result, negotiate_encoding, negotiate_media_type
 from fastapi.middleware.cors import CORSMiddleware
+from collections import OrderedDict
+from typing import Dict, Optional
+import asyncio
+import json
+import math
+import time
+import urllib.error
 import uvicorn
 import os
 import logging
+import threading
 import resource
 from config import config
 
+config.load_from_env()
+
 # Configure logging
 logging.basicConfig(level=getattr(logging, config.get("app", "log_level", "INFO")))
 logger = logging.getLogger(__name__)
@@ -19,8 +32,69 @@ app = FastAPI(
     title=config.get("app", "title", "OllaRuntime"),
     version=config.get("app", "version", "1.0.0")
 )
+
+# Enable CORS for Electron/Vite
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 runtime = PythonRuntime()
 parser = CodeParser()
+scheduler = ExecutionScheduler.from_config()
+
+# Runtimes owned by this worker, keyed by session id, least recently used first.
+# Created on the scheduler thread and released from the event loop
+sessions: Dict[str, PythonRuntime] = OrderedDict(default=runtime)
+session_last_used: Dict[str, float] = {"default": time.monotonic()}
+sessions_lock = threading.RLock()
+# Set on startup when cluster mode is enabled
+cluster: Optional[ClusterNode] = None
+
+def get_session_runtime(session_id: str) -> PythonRuntime:
+    now = time.monotonic()
+    with sessions_lock:
+        evict_idle_sessions(now)
+        if session_id not in sessions:
+            max_sessions = config.get("limits", "max_sessions", 1000)
+            while max_sessions and len(sessions) >= max_sessions:
+                evict_session(next(iter(sessions)))
+            sessions[session_id] = PythonRuntime()
+        sessions.move_to_end(session_id)
+        session_last_used[session_id] = now
+        return sessions[session_id]
+
+def session_cpu_time(session_id: str) -> float:
+    session_runtime = sessions.get(session_id)
+    return session_runtime.cpu_time if session_runtime is not None else 0.0
+
+def evict_idle_sessions(now: float):
+    idle_timeout = config.get("limits", "session_idle_timeout", 3600)
+    if not idle_timeout:
+        return
+    while sessions:
+        session_id = next(iter(sessions))
+        if now - session_last_used[session_id] < idle_timeout:
+            break
+        evict_session(session_id)
+
+def evict_session(session_id: str):
+    logger.info(f"Evicting session {session_id}")
+    release_session(session_id)
+    if cluster is not None:
+        cluster.forget(session_id)
+
+def release_session(session_id: str):
+    # Called when the cluster hands a session to another worker
+    with sessions_lock:
+        session_runtime = sessions.pop(session_id, None)
+        session_last_used.pop(session_id, None)
+    if session_runtime is not None:
+        session_runtime.terminate()
+    scheduler.forget_session(session_id)
 
 # Mount static files for the dashboard
 app.mount("/static", StaticFiles(directory="."), name="static")
@@ -31,104 +105,164 @@ async def get_dashboard():
 
 class ExecuteRequest(BaseModel):
     prompt: str = Field(..., min_length=1, max_length=config.get("limits", "max_code_length", 10000), description="Code or prompt to execute")
+    session_id: str = Field("default", min_length=1, max_length=128, description="Session whose state the code runs in")
+    tenant_id: str = Field("default", min_length=1, max_length=128, description="Tenant the execution is accounted to")
+    lane: Optional[str] = Field(None, description="Scheduling lane, e.g. 'interactive' or 'batch'")
+    rerun_dependents: bool = Field(False, description="Re-run earlier blocks that depend on the names this code changes")
 
 @app.post("/api/execute")
-async def execute(request: ExecuteRequest):
+async def execute(request: ExecuteRequest, http_request: Request):
     try:
         # Validate request
         if not request.prompt.strip():
             return JSONResponse(status_code=400, content={"error": "Empty prompt"})
 
+        forwarded = cluster is not None and await asyncio.to_thread(is_forwarded_by_peer, http_request)
+        tenant_id, lane = request.tenant_id, request.lane
+        if not forwarded and not is_trusted_client(http_request):
+            # A client naming itself could rotate tenant ids past its quota or jump the lanes
+            tenant_id, lane = f"client:{client_host(http_request)}", None
+
+        # Forward to the owning worker unless a peer already forwarded this request
+        if cluster is not None and not forwarded:
+            body = json.dumps({**request.model_dump(), "tenant_id": tenant_id, "lane": lane}).encode()
+            response = await forward_to_owner(request.session_id, body, http_request)
+            if response is not None:
+                return response
+
         # Extract code blocks
         code_blocks = parser.extract_code(request.prompt)
         if not code_blocks:
             # Fallback: Treat whole prompt as code if no blocks found
             code_blocks = [request.prompt]
 
-        output = ""
-        for block in code_blocks:
-            result = runtime.execute(block)
-            output += f"{result}\n"
+        media_type = negotiate_media_type(http_request.headers.get("accept"))
+        encoding = negotiate_encoding(http_request.headers.get("accept-encoding"))
+
+        def run_blocks():
+            # Created only once the scheduler admitted the request, so a request turned
+            # away with 429 never evicts another session to make room
+            session_runtime = get_session_runtime(request.session_id)
+            output = ""
+            extra = None
+            if request.rerun_dependents:
+                extra = {"reran": [], "skipped": []}
+                submitted = set()
+                for block in code_blocks:
+                    report = session_runtime.rerun_dependents(block)
+                    output += f"{report['output']}\n"
+                    submitted.add(report["block"])
+                    extra["reran"] += report["reran"]
+                rerun_ids = {item["block"] for item in extra["reran"]}
+                extra["skipped"] = [b.id for b in session_runtime.graph.blocks
+                                    if b.id not in rerun_ids and b.id not in submitted]
+            else:
+                for block in code_blocks:
+                    result = session_runtime.execute(block)
+                    output += f"{result}\n"
+            # Encode while still on the scheduler thread, before the next job changes the session
+            body = encode_execute_result(
+                output.strip(), session_runtime.get_encoded_variables(media_type), media_type, extra
+            )
+            return compress(body, encoding)
+
+        try:
+            future = scheduler.submit(
+                run_blocks,
+                tenant_id=tenant_id,
+                session_id=request.session_id,
+                lane=lane,
+                meter=lambda: session_cpu_time(request.session_id)
+            )
+        except QuotaExceeded as e:
+            return JSONResponse(
+                status_code=429,
+                content={"error": str(e)},
+                headers={"Retry-After": str(math.ceil(e.retry_after))}
+            )
+        except SchedulerError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
 
-        return {
-            "output": output.strip(),
-            "variables": runtime.get_variables()
-        }
+        body, content_encoding = await asyncio.wrap_future(future)
+        headers = {"Vary": "Accept, Accept-Encoding"}
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        return Response(content=body, media_type=media_type, headers=headers)
     except HTTPException as e:
         raise e
     except Exception as e:
         logger.error(f"Execution error: {str(e)}")
         return JSONResponse(status_code=500, content={"error": "Internal server error"})
 
-@app.on_event("shutdown")
-def shutdown_event():
-    runtime.terminate()
-
-@app.exception_handler(Exception)
-async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled exception: {str(exc)}")
-    return JSONResponse(
-        status_code=500,
-        content={"error": "An unexpected error occurred"}
-    )
-
-if __name__ == "__main__":
-    logger.info(f"Starting {config.get('app', 'title', 'OllaRuntime')} server...")
-    uvicorn.run(
-        app,
-        host=config.get("app", "host", "0.0.0.0"),
-        port=config.get("app", "port", 8000),
-        log_level=config.get("app", "log_level", "info")
-    )
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-app = FastAPI(title="OllaRuntime API", version="1.0.0")
-runtime = PythonRuntime()
-parser = CodeParser()
+def client_host(http_request: Request) -> Optional[str]:
+    return http_request.client.host if http_request.client else None
 
-# Mount static files for the dashboard
-app.mount("/static", StaticFiles(directory="."), name="static")
+def is_trusted_client(http_request: Request) -> bool:
+    # Only these hosts, e.g. a gateway that authenticates tenants, may choose tenant and lane
+    return client_host(http_request) in config.get("scheduler", "trusted_clients", [])
 
-@app.get("/")
-async def get_dashboard():
-    return FileResponse("index.html")
+def is_forwarded_by_peer(http_request: Request) -> bool:
+    # Clients could otherwise set the header to skip routing and fork a session
+    worker_id = http_request.headers.get(FORWARDED_HEADER)
+    return worker_id is not None and cluster.is_peer(worker_id, client_host(http_request))
 
-class ExecuteRequest(BaseModel):
-    prompt: str = Field(..., min_length=1, max_length=10000, description="Code or prompt to execute")
+async def forward_to_owner(session_id: str, body: bytes, http_request: Request) -> Optional[Response]:
+    """Relay the request to the worker owning the session; None if this worker owns it."""
+    headers = {"Content-Type": "application/json"}
+    for name in ("Accept", "Accept-Encoding"):
+        if name in http_request.headers:
+            headers[name] = http_request.headers[name]
+    # Each unreachable owner is dropped from the ring, so this ends on a live worker or on this one
+    while True:
+        owner, address = await asyncio.to_thread(cluster.route, session_id)
+        if owner == cluster.worker_id:
+            return None
+        try:
+            status, response_headers, response_body = await asyncio.to_thread(
+                cluster.forward, address, http_request.url.path, body, headers
+            )
+        except urllib.error.URLError as e:
+            logger.warning(f"Worker {owner} unreachable, re-routing session {session_id}: {e.reason}")
+            await asyncio.to_thread(cluster.mark_unreachable, owner)
+            continue
+        except TimeoutError:
+            return JSONResponse(status_code=504, content={"error": f"Worker {owner} did not respond in time"})
+        return Response(content=response_body, status_code=status, headers=response_headers)
 
-@app.post("/api/execute")
-async def execute(request: ExecuteRequest):
-    try:
-        # Validate request
-        if not request.prompt.strip():
-            return JSONResponse(status_code=400, content={"error": "Empty prompt"})
-
-        # Extract code blocks
-        code_blocks = parser.extract_code(request.prompt)
-        if not code_blocks:
-            # Fallback: Treat whole prompt as code if no blocks found
-            code_blocks = [request.prompt]
+@app.get("/api/cluster")
+async def cluster_status():
+    if cluster is None:
+        return {"enabled": False, "sessions": len(sessions)}
+    return {
+        "enabled": True,
+        "worker_id": cluster.worker_id,
+        "workers": sorted(cluster.workers),
+        "sessions": len(sessions)
+    }
 
-        output = ""
-        for block in code_blocks:
-            result = runtime.execute(block)
-            output += f"{result}\n"
+@app.get("/api/scheduler")
+async def scheduler_status():
+    return scheduler.stats()
 
-        return {
-            "output": output.strip(),
-            "variables": runtime.get_variables()
-        }
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        logger.error(f"Execution error: {str(e)}")
-        return JSONResponse(status_code=500, content={"error": "Internal server error"})
+@app.on_event("startup")
+def startup_event():
+    global cluster
+    scheduler.start()
+    if config.get("cluster", "enabled", False):
+        # Releases come from the heartbeat and routing threads; sessions are only changed on the loop
+        loop = asyncio.get_running_loop()
+        cluster = ClusterNode.from_config(
+            on_release=lambda session_id: loop.call_soon_threadsafe(release_session, session_id)
+        )
+        cluster.start()
 
 @app.on_event("shutdown")
 def shutdown_event():
-    runtime.terminate()
+    if cluster is not None:
+        cluster.stop()
+    scheduler.stop()
+    for session_runtime in sessions.values():
+        session_runtime.terminate()
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -139,60 +273,20 @@ async def global_exception_handler(request: Request, exc: Exception):
     )
 
 if __name__ == "__main__":
-    logger.info("Starting OllaRuntime server...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
-app = FastAPI(title="OllaRuntime API")
-
-# Enable CORS for Electron/Vite
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-runtime = PythonRuntime()
-parser = CodeParser()
-
-# Mount static files for the dashboard
-app.mount("/static", StaticFiles(directory="."), name="static")
-
-@app.get("/")
-async def get_dashboard():
-    return FileResponse("index.html")
-
-class ExecuteRequest(BaseModel):
-    prompt: str
-
-@app.post("/api/execute")
-async def execute(request: ExecuteRequest):
-    # In a real scenario, we would call Ollama here.
-    # For now, we simulate Ollama generating code based on the prompt.
-    # Example: "Define x = 10" -> LLM generates "x = 10"
-    
-    # Simulate Ollama response (Mocking for now)
-    # real_llm_response = call_ollama(request.prompt)
-    
-    # For the POC, we assume the prompt IS the code or contains it
-    code_blocks = parser.extract_code(request.prompt)
-    if not code_blocks:
-        # Fallback: Treat whole prompt as code if no blocks found
-        code_blocks = [request.prompt]
-    
-    output = ""
-    for block in code_blocks:
-        result = runtime.execute(block)
-        output += f"{result}\n"
-    
-    return {
-        "output": output.strip(),
-        "variables": runtime.get_variables()
-    }
-
-@app.on_event("shutdown")
-def shutdown_event():
-    runtime.terminate()
-
-if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    logger.info(f"Starting {config.get('app', 'title', 'OllaRuntime')} server...")
+    workers = config.get("cluster", "workers", 1)
+    if config.get("cluster", "enabled", False) and workers > 1:
+        run_workers(
+            "main:app",
+            workers,
+            host=config.get("app", "host", "0.0.0.0"),
+            port=config.get("app", "port", 8000),
+            log_level=config.get("app", "log_level", "info").lower()
+        )
+    else:
+        uvicorn.run(
+            app,
+            host=config.get("app", "host", "0.0.0.0"),
+            port=config.get("app", "port", 8000),
+            log_level=config.get("app", "log_level", "info").lower()
+        )
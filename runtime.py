@@ -1,23 +1,221 @@
-import code
+import ast
+import decimal
+import functools
+import importlib
+import re
 import io
+import signal
 import sys
+import logging
+import threading
 import traceback
 import time
 import resource
+import weakref
 from contextlib import redirect_stdout, redirect_stderr
-from types import SimpleNamespace
+from types import FunctionType, ModuleType, SimpleNamespace
+from budget import BudgetExceeded, ExecutionBudget, instrument, validate_names
 from config import config
+from dependencies import DependencyGraph, analyze
+from serialization import JSON, NotSerializable, dumps_json, encode_variables
+
+logger = logging.getLogger(__name__)
 
 class SandboxError(Exception):
     pass
 
+# Dunder attributes a sandboxed module proxy still exposes; isinstance() reads __class__
+_PUBLIC_MODULE_ATTRIBUTES = ('__name__', '__doc__', '__all__', '__class__')
+
+# Allowlisted modules imported once per worker process and shared by every session
+_shared_modules = {}
+_shared_modules_lock = threading.Lock()
+# Allowlisted modules that failed to preload, so later sessions skip the lookup
+_unavailable_modules = set()
+
+class ModuleProxy:
+    """Read-only view of a shared module handed out by the sandbox import.
+
+    overrides replaces module attributes for one session, e.g. functions bound
+    to session-local state.
+    """
+    __slots__ = ('_ModuleProxy__module', '_ModuleProxy__overrides')
+
+    def __init__(self, module, overrides=None):
+        object.__setattr__(self, '_ModuleProxy__module', module)
+        object.__setattr__(self, '_ModuleProxy__overrides', overrides or {})
+
+    def __getattribute__(self, name):
+        if name.startswith('_') and name not in _PUBLIC_MODULE_ATTRIBUTES:
+            raise SandboxError(f"Access to private attributes is restricted: {name}")
+        overrides = object.__getattribute__(self, '_ModuleProxy__overrides')
+        if name in overrides:
+            return overrides[name]
+        module = object.__getattribute__(self, '_ModuleProxy__module')
+        if name == '__all__' and not hasattr(module, '__all__'):
+            # Lets `from module import *` work without exposing __dict__
+            return [attr for attr in dir(module)
+                    if not attr.startswith('_') and not isinstance(getattr(module, attr), ModuleType)]
+        value = getattr(module, name)
+        if isinstance(value, ModuleType):
+            # Submodules are only reachable when they are allowlisted themselves
+            if not is_import_allowed(value.__name__):
+                raise SandboxError(f"Import of '{value.__name__}' is not allowed")
+            if value.__name__ in _SESSION_MODULE_FACTORIES:
+                # Only the import statement hands out the session's own view
+                raise SandboxError(f"Import '{value.__name__}' directly instead")
+            return get_shared_module(value.__name__)
+        return value
+
+    def __setattr__(self, name, value):
+        raise SandboxError(f"Shared module attributes are read-only: {name}")
+
+    def __delattr__(self, name):
+        raise SandboxError(f"Shared module attributes are read-only: {name}")
+
+    def __repr__(self):
+        module = object.__getattribute__(self, '_ModuleProxy__module')
+        return f"<module '{module.__name__}' (shared, read-only)>"
+
+def is_import_allowed(name):
+    # Exact entries only: a package being allowed says nothing about its submodules
+    # (json.tool, collections.abc), which have to be listed one by one
+    return name in config.get("security", "allowed_imports", [])
+
+def get_shared_module(name):
+    proxy = _shared_modules.get(name)
+    if proxy is None:
+        with _shared_modules_lock:
+            proxy = _shared_modules.get(name)
+            if proxy is None:
+                proxy = ModuleProxy(importlib.import_module(name))
+                _shared_modules[name] = proxy
+    return proxy
+
+def preload_modules(names=None):
+    # Import the allowlist up front so sessions never pay the import cost
+    if names is None:
+        names = config.get("security", "allowed_imports", [])
+    for name in names:
+        if name in _shared_modules or name in _unavailable_modules:
+            continue
+        try:
+            get_shared_module(name)
+        except ImportError:
+            _unavailable_modules.add(name)
+            logger.info(f"Allowed module not available, skipping preload: {name}")
+
+def restricted_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level != 0:
+        raise ImportError("Relative imports are not supported in the sandbox")
+    top_level = name.partition('.')[0]
+    if not is_import_allowed(name) or (not fromlist and not is_import_allowed(top_level)):
+        raise ImportError(f"Import of '{name}' is not allowed")
+    module = get_shared_module(name)
+    if fromlist:
+        return module
+    # `import a.b` binds `a`, mirroring the builtin __import__
+    return get_shared_module(top_level)
+
+def _session_random(module):
+    # The module-level functions are methods of one hidden Random instance;
+    # rebinding them keeps one session's seed() from fixing another's numbers
+    shared = module._inst
+    instance = module.Random()
+    overrides = {}
+    for name in dir(module):
+        if getattr(getattr(module, name), '__self__', None) is shared:
+            overrides[name] = getattr(instance, name)
+    return ModuleProxy(module, overrides)
+
+# Shared modules whose module-level functions keep hidden global state; each
+# session imports its own view of them
+_SESSION_MODULE_FACTORIES = {'random': _session_random}
+
+# Budget of the execution running on this worker; executions never overlap
+_active_budget = None
+
+def _on_cpu_limit(signum, frame):
+    # The default action kills the worker and every session on it; stop only the
+    # running execution, at its next budget check
+    if _active_budget is not None:
+        _active_budget.exhaust("CPU time limit exceeded")
+
+try:
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+except (AttributeError, ValueError):
+    pass  # No SIGXCPU on this platform, or not imported from the main thread
+
+def _metered(builtin, iterable_only=False):
+    # These builtins loop over their argument in C, where no inserted budget check runs
+    @functools.wraps(builtin)
+    def call(*args, **kwargs):
+        if _active_budget is not None and args and not (iterable_only and len(args) > 1):
+            args = (_active_budget.meter(args[0]),) + args[1:]
+        return builtin(*args, **kwargs)
+    return call
+
+# Filename of code compiled from sandboxed source
+SANDBOX_FILENAME = '<sandbox>'
+# Called with the object of every attribute assignment or deletion in sandboxed code
+ATTRIBUTES_NAME = '__sandbox_attributes__'
+# Methods that change the class they are looked up on, for every user of it:
+# ABCMeta.register makes isinstance() true for another type worker-wide
+_CLASS_MUTATORS = frozenset({'register'})
+
+class AttributeRewriter(ast.NodeTransformer):
+    """Route attribute stores and deletes through the sandbox's checked helper.
+
+    `obj.name = value` becomes `__sandbox_attributes__(obj)['name'] = value`,
+    which also covers augmented assignment, unpacking and loop targets. Loads
+    of class mutators such as `.register` go the same way. If user code
+    shadows the helper the result is a plain subscript, never a setattr on a
+    shared object.
+    """
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, (ast.Store, ast.Del)) and node.attr not in _CLASS_MUTATORS:
+            return node
+        helper = ast.Call(func=ast.Name(id=ATTRIBUTES_NAME, ctx=ast.Load()), args=[node.value], keywords=[])
+        return ast.copy_location(ast.Subscript(value=helper, slice=ast.Constant(value=node.attr), ctx=node.ctx), node)
+
+class AttributeView:
+    """Attributes of one object, accessed by subscript; writable only for objects the session created."""
+    __slots__ = ('_AttributeView__target', '_AttributeView__writable')
+
+    def __init__(self, target, writable):
+        object.__setattr__(self, '_AttributeView__target', target)
+        object.__setattr__(self, '_AttributeView__writable', writable)
+
+    def __checked(self, name, store):
+        # The helper can be called directly, so names are checked here as well
+        if not isinstance(name, str) or name.startswith('_'):
+            raise SandboxError(f"Access to private attributes is restricted: {name}")
+        if store and not object.__getattribute__(self, '_AttributeView__writable'):
+            raise SandboxError(f"Attributes of shared objects are read-only: {name}")
+        return object.__getattribute__(self, '_AttributeView__target')
+
+    def __getitem__(self, name):
+        return getattr(self.__checked(name, store=name in _CLASS_MUTATORS), name)
+
+    def __setitem__(self, name, value):
+        setattr(self.__checked(name, store=True), name, value)
+
+    def __delitem__(self, name):
+        delattr(self.__checked(name, store=True), name)
+
 class RestrictedEnvironment:
     def __init__(self):
+        self.session_modules = {}
+        # Classes defined by this session's code, keyed by id so a metaclass
+        # overriding __eq__ cannot pass a shared class off as one of them
+        self.classes = weakref.WeakValueDictionary()
         self.locals = {
             '__builtins__': {
                 'abs': abs,
-                'all': all,
-                'any': any,
+                'all': _metered(all),
+                'any': _metered(any),
                 'bin': bin,
                 'bool': bool,
                 'chr': chr,
@@ -31,8 +229,8 @@ class RestrictedEnvironment:
                 'len': len,
                 'list': list,
                 'map': map,
-                'max': max,
-                'min': min,
+                'max': _metered(max, iterable_only=True),
+                'min': _metered(min, iterable_only=True),
                 'oct': oct,
                 'ord': ord,
                 'pow': pow,
@@ -44,16 +242,48 @@ class RestrictedEnvironment:
                 'slice': slice,
                 'sorted': sorted,
                 'str': str,
-                'sum': sum,
+                'sum': _metered(sum),
                 'tuple': tuple,
                 'type': type,
                 'zip': zip,
+                '__import__': self._import,
+                '__build_class__': self._build_class,
+                ATTRIBUTES_NAME: self._attributes,
             },
             '__name__': '__main__',
             '__doc__': None,
             '__package__': None
         }
 
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = restricted_import(name, globals, locals, fromlist, level)
+        module_name = module.__name__
+        if module_name in _SESSION_MODULE_FACTORIES:
+            if module_name not in self.session_modules:
+                shared = object.__getattribute__(module, '_ModuleProxy__module')
+                self.session_modules[module_name] = _SESSION_MODULE_FACTORIES[module_name](shared)
+            return self.session_modules[module_name]
+        return module
+
+    def _build_class(self, func, name, *bases, **kwargs):
+        cls = __build_class__(func, name, *bases, **kwargs)
+        self.classes[id(cls)] = cls
+        return cls
+
+    def _is_sandbox_class(self, cls):
+        return self.classes.get(id(cls)) is cls
+
+    def _attributes(self, target):
+        # Modules, classes and functions from shared modules belong to the whole
+        # worker; only what this session's code created may be changed
+        if isinstance(target, type):
+            writable = self._is_sandbox_class(target)
+        elif isinstance(target, FunctionType):
+            writable = target.__code__.co_filename == SANDBOX_FILENAME
+        else:
+            writable = self._is_sandbox_class(type(target))
+        return AttributeView(target, writable)
+
     def __getitem__(self, key):
         return self.locals.get(key)
 
@@ -67,27 +297,57 @@ class RestrictedEnvironment:
 
 class PythonRuntime:
     def __init__(self):
-        self.console = code.InteractiveConsole()
         self.output_buffer = io.StringIO()
         self.environment = RestrictedEnvironment()
         self.max_execution_time = config.get("security", "max_execution_time", 5)
         self.max_memory_usage = config.get("security", "max_memory_usage", 100 * 1024 * 1024)
         self.max_variables = config.get("limits", "max_variables", 100)
         self.max_nesting_depth = config.get("limits", "max_nesting_depth", 10)
+        self.max_execution_steps = config.get("limits", "max_execution_steps", 10_000_000)
+        # CPU seconds spent inside the sandbox over the session's lifetime
+        self.cpu_time = 0.0
+        # Def/use history of executed blocks, for re-running dependents
+        self.graph = DependencyGraph(config.get("limits", "max_history_blocks", 200))
+        self.last_block = None
+        # decimal keeps its context per thread, and every session runs on the scheduler's
+        self.decimal_context = decimal.Context()
+        preload_modules()
 
     def _set_resource_limits(self):
-        # Set CPU time limit
+        """Arm process-wide limits for one execution; returns the limits to restore after it.
+
+        Limits are relative to what the worker already uses. Exceeding the CPU
+        limit raises SIGXCPU, which stops the execution instead of the worker.
+        """
+        previous = []
         try:
-            resource.setrlimit(resource.RLIMIT_CPU, (self.max_execution_time, self.max_execution_time))
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            cpu_used = int(usage.ru_utime + usage.ru_stime)
+            previous.append(self._set_soft_limit(resource.RLIMIT_CPU, cpu_used + self.max_execution_time))
         except (ValueError, AttributeError):
             pass  # Resource limits not supported on this platform
 
         # Set memory limit (if supported)
         try:
             if self.max_memory_usage > 0:
-                resource.setrlimit(resource.RLIMIT_AS, (self.max_memory_usage, self.max_memory_usage))
-        except (ValueError, AttributeError):
+                with open('/proc/self/statm') as statm:
+                    address_space = int(statm.read().split()[0]) * resource.getpagesize()
+                previous.append(self._set_soft_limit(resource.RLIMIT_AS, address_space + self.max_memory_usage))
+        except (OSError, ValueError, AttributeError):
             pass  # Resource limits not supported on this platform
+        return previous
+
+    def _set_soft_limit(self, limit_type, value):
+        # Only the soft limit moves; lowering the hard limit could never be undone
+        soft, hard = resource.getrlimit(limit_type)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(limit_type, (value, hard))
+        return limit_type, (soft, hard)
+
+    def _restore_resource_limits(self, previous):
+        for limit_type, limits in previous:
+            resource.setrlimit(limit_type, limits)
 
     def _validate_code(self, code_str):
         # Check for dangerous patterns
@@ -95,6 +355,21 @@ class PythonRuntime:
             if re.search(pattern, code_str, re.IGNORECASE):
                 raise SandboxError(f"Restricted operation detected: {pattern}")
 
+        # Check attribute access on private names (e.g. obj.__globals__)
+        tree = ast.parse(code_str)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node.id == ATTRIBUTES_NAME:
+                raise SandboxError(f"Reserved name: {node.id}")
+            if isinstance(node, ast.Attribute):
+                if node.attr.startswith('_'):
+                    raise SandboxError(f"Access to private attributes is restricted: {node.attr}")
+
+        # Check for names used by the execution budget
+        try:
+            validate_names(tree)
+        except ValueError as e:
+            raise SandboxError(str(e))
+
         # Check nesting depth
         nesting_level = self._calculate_nesting_level(code_str)
         if nesting_level > self.max_nesting_depth:
@@ -104,6 +379,8 @@ class PythonRuntime:
         if self._count_variables(code_str) > self.max_variables:
             raise SandboxError(f"Too many variables in code")
 
+        return tree
+
     def _calculate_nesting_level(self, code_str):
         max_depth = 0
         current_depth = 0
@@ -121,8 +398,38 @@ class PythonRuntime:
         variables = re.findall(r'\b\w+\b(?=\s*=)', code_str)
         return len(set(variables))
     def execute(self, code_str: str):
+        return self._execute(code_str, record=True)
+
+    def rerun_dependents(self, code_str: str):
+        """Execute a block, then re-run the recorded blocks downstream of the names it changed.
+
+        Returns the block's output plus which blocks were re-run and which were skipped.
+        """
+        output = self.execute(code_str)
+        block = self.last_block
+        if block is None:
+            # Rejected or failed, so its names are not treated as changed
+            return {"output": output, "block": None, "reran": [], "skipped": [b.id for b in self.graph.blocks]}
+
+        changed = set(block.defines)
+        reran = []
+        for other in self.graph.downstream(block):
+            if other.uses & changed:
+                reran.append({"block": other.id, "output": self._execute(other.source, record=False)})
+                changed |= other.defines
+            elif other.defines & changed:
+                # Re-running it restores the values later blocks saw before
+                reran.append({"block": other.id, "output": self._execute(other.source, record=False)})
+                changed -= other.defines
+        rerun_ids = {item["block"] for item in reran}
+        skipped = [other.id for other in self.graph.blocks if other is not block and other.id not in rerun_ids]
+        return {"output": output, "block": block.id, "reran": reran, "skipped": skipped}
+
+    def _execute(self, code_str: str, record: bool):
         # Clear buffer
         self.output_buffer = io.StringIO()
+        if record:
+            self.last_block = None
 
         try:
             # Check code length
@@ -130,229 +437,122 @@ class PythonRuntime:
                 raise SandboxError("Code exceeds maximum allowed length")
 
             # Parse and validate code
-            self._validate_code(code_str)
+            tree = self._validate_code(code_str)
+            # Analyzed before instrumentation, recorded only once the block has run cleanly
+            names = analyze(tree) if record else None
 
-            # Set resource limits
-            self._set_resource_limits()
+            # Check every attribute store against the objects the session created
+            tree = ast.fix_missing_locations(AttributeRewriter().visit(tree))
+            # Add execution budget checks to loops and function entries
+            if self.max_execution_steps:
+                tree = instrument(tree)
 
             start_time = time.time()
-            with redirect_stdout(self.output_buffer), redirect_stderr(self.output_buffer):
-                # Execute in restricted environment
-                self._execute_in_sandbox(code_str)
+            cpu_start = time.thread_time()
+            worker_context = decimal.getcontext()
+            decimal.setcontext(self.decimal_context)
+            # Set resource limits
+            previous_limits = self._set_resource_limits()
+            try:
+                with redirect_stdout(self.output_buffer), redirect_stderr(self.output_buffer):
+                    # Execute in restricted environment
+                    self._execute_in_sandbox(tree)
+            finally:
+                self._restore_resource_limits(previous_limits)
+                self.decimal_context = decimal.getcontext()
+                decimal.setcontext(worker_context)
+                self.cpu_time += time.thread_time() - cpu_start
 
             execution_time = time.time() - start_time
             if execution_time > self.max_execution_time:
                 raise SandboxError(f"Execution time exceeded: {execution_time:.2f}s")
 
+            if record:
+                self.last_block = self.graph.add(code_str, *names)
             return self.output_buffer.getvalue().strip()
         except SandboxError as e:
             return f"Security Error: {str(e)}"
         except SyntaxError as e:
             return f"Syntax Error: {str(e)}"
+        except BudgetExceeded as e:
+            return self._with_output(f"Budget Error: {str(e)}")
         except Exception as e:
-            return f"Runtime Error: {str(e)}\n{traceback.format_exc()}"
-
-    def _validate_code(self, code_str):
-        # Check for dangerous patterns
-        for pattern in config.get("security", "restricted_operations", []):
-            if re.search(pattern, code_str, re.IGNORECASE):
-                raise SandboxError(f"Restricted operation detected: {pattern}")
-
-    def _execute_in_sandbox(self, code_str):
-        lines = code_str.splitlines()
-        for line in lines:
-            # Use restricted environment
-            self.console.push(line)
-            # Update environment with new variables
-            for name, value in self.console.locals.items():
-                if not name.startswith('__'):
-                    self.environment[name] = value
-
-    def get_variables(self):
-        # Filter out built-ins and internal names, and ensure they are JSON serializable
-        vars_dict = {}
-        for k, v in self.environment.locals.items():
-            if not k.startswith('__'):
-                try:
-                    import json
-                    json.dumps(v)
-                    vars_dict[k] = v
-                except:
-                    vars_dict[k] = f"<{type(v).__name__} object>"
-        return vars_dict
-
-    def terminate(self):
-        pass # No process to kill
-class SandboxError(Exception):
-    pass
-
-class RestrictedEnvironment:
-    def __init__(self):
-        self.locals = {
-            '__builtins__': {
-                'abs': abs,
-                'all': all,
-                'any': any,
-                'bin': bin,
-                'bool': bool,
-                'chr': chr,
-                'dict': dict,
-                'divmod': divmod,
-                'enumerate': enumerate,
-                'filter': filter,
-                'float': float,
-                'hex': hex,
-                'int': int,
-                'len': len,
-                'list': list,
-                'map': map,
-                'max': max,
-                'min': min,
-                'oct': oct,
-                'ord': ord,
-                'pow': pow,
-                'print': print,
-                'range': range,
-                'repr': repr,
-                'round': round,
-                'set': set,
-                'slice': slice,
-                'sorted': sorted,
-                'str': str,
-                'sum': sum,
-                'tuple': tuple,
-                'type': type,
-                'zip': zip,
-            },
-            '__name__': '__main__',
-            '__doc__': None,
-            '__package__': None
-        }
-
-    def __getitem__(self, key):
-        return self.locals.get(key)
-
-    def __setitem__(self, key, value):
-        if key.startswith('_'):
-            raise SandboxError(f"Access to private attributes is restricted: {key}")
-        self.locals[key] = value
-
-    def __contains__(self, key):
-        return key in self.locals
-
-class PythonRuntime:
-    def __init__(self):
-        self.console = code.InteractiveConsole()
-        self.output_buffer = io.StringIO()
-        self.environment = RestrictedEnvironment()
-
-    def execute(self, code_str: str):
-        # Clear buffer
-        self.output_buffer = io.StringIO()
-
+            return self._with_output(f"Runtime Error: {str(e)}\n{traceback.format_exc()}")
+        except (SystemExit, KeyboardInterrupt) as e:
+            # Raised by library code such as a module's main(); must not reach the server
+            return self._with_output(f"Runtime Error: {type(e).__name__}: {str(e)}")
+
+    def _with_output(self, message):
+        # Keep whatever the code printed before it stopped
+        output = self.output_buffer.getvalue().strip()
+        return f"{output}\n{message}" if output else message
+
+    def _execute_in_sandbox(self, tree):
+        global _active_budget
+        namespace = self.environment.locals
+        budget = None
+        if self.max_execution_steps:
+            budget = ExecutionBudget(self.max_execution_steps)
+            budget.install(namespace)
+        _active_budget = budget
         try:
-            # Parse and validate code
-            self._validate_code(code_str)
-
-            with redirect_stdout(self.output_buffer), redirect_stderr(self.output_buffer):
-                # Execute in restricted environment
-                self._execute_in_sandbox(code_str)
-
-            return self.output_buffer.getvalue().strip()
-        except SandboxError as e:
-            return f"Security Error: {str(e)}"
-        except SyntaxError as e:
-            return f"Syntax Error: {str(e)}"
-        except Exception as e:
-            return f"Runtime Error: {str(e)}\n{traceback.format_exc()}"
-
-    def _validate_code(self, code_str):
-        # Check for dangerous patterns
-        dangerous_patterns = [
-            r'import\s+os',
-            r'import\s+sys',
-            r'import\s+subprocess',
-            r'import\s+shutil',
-            r'import\s+glob',
-            r'import\s+pathlib',
-            r'from\s+os',
-            r'from\s+sys',
-            r'from\s+subprocess',
-            r'from\s+shutil',
-            r'from\s+glob',
-            r'from\s+pathlib',
-            r'open\s*\(',
-            r'exec\s*\(',
-            r'eval\s*\(',
-            r'compile\s*\(',
-            r'globals\s*\(',
-            r'locals\s*\(',
-            r'del\s+',
-            r'assert\s+',
-            r'raise\s+',
-        ]
-
-        for pattern in dangerous_patterns:
-            if re.search(pattern, code_str, re.IGNORECASE):
-                raise SandboxError(f"Restricted operation detected: {pattern}")
-
-    def _execute_in_sandbox(self, code_str):
-        lines = code_str.splitlines()
-        for line in lines:
-            # Use restricted environment
-            self.console.push(line)
-            # Update environment with new variables
-            for name, value in self.console.locals.items():
-                if not name.startswith('__'):
-                    self.environment[name] = value
+            self._run_statements(tree, budget)
+        finally:
+            _active_budget = None
+
+    def _run_statements(self, tree, budget):
+        namespace = self.environment.locals
+        # Sandbox internals such as __builtins__, which user code must leave untouched
+        internals = {name: value for name, value in namespace.items() if name.startswith('__')}
+        # 'single' mode echoes expression results like the interactive console
+        statements = [compile(ast.Interactive(body=[stmt]), SANDBOX_FILENAME, 'single') for stmt in tree.body]
+        for statement in statements:
+            try:
+                exec(statement, namespace)
+            except Exception:
+                # Whatever surfaced, a spent budget is the reason execution stopped
+                if budget is not None:
+                    budget.check()
+                raise
+            if budget is not None:
+                budget.check()
+            # Validate new variables against the environment rules
+            for name, value in list(namespace.items()):
+                if name.startswith('__'):
+                    if name not in internals or internals[name] is not value:
+                        self._restore_internals(internals)
+                        raise SandboxError(f"Sandbox internals were modified: {name}")
+                else:
+                    try:
+                        self.environment[name] = value
+                    except SandboxError:
+                        del namespace[name]
+                        raise
+
+    def _restore_internals(self, internals):
+        namespace = self.environment.locals
+        for name in [name for name in namespace if name.startswith('__') and name not in internals]:
+            del namespace[name]
+        namespace.update(internals)
+
+    def _public_variables(self):
+        # Filter out built-ins and internal names
+        return [(k, v) for k, v in self.environment.locals.items() if not k.startswith('__')]
 
     def get_variables(self):
-        # Filter out built-ins and internal names, and ensure they are JSON serializable
+        # Ensure the values are JSON serializable
         vars_dict = {}
-        for k, v in self.environment.locals.items():
-            if not k.startswith('__'):
-                try:
-                    import json
-                    json.dumps(v)
-                    vars_dict[k] = v
-                except:
-                    vars_dict[k] = f"<{type(v).__name__} object>"
+        for k, v in self._public_variables():
+            try:
+                dumps_json(v)
+                vars_dict[k] = v
+            except NotSerializable:
+                vars_dict[k] = f"<{type(v).__name__} object>"
         return vars_dict
 
-    def terminate(self):
-        pass # No process to kill
-class PythonRuntime:
-    def __init__(self):
-        self.console = code.InteractiveConsole()
-        self.output_buffer = io.StringIO()
-
-    def execute(self, code_str: str):
-        # Clear buffer
-        self.output_buffer = io.StringIO()
-        
-        # We need to handle multi-line input correctly
-        lines = code_str.splitlines()
-        
-        with redirect_stdout(self.output_buffer), redirect_stderr(self.output_buffer):
-            for line in lines:
-                # console.push returns True if more input is required (incomplete block)
-                self.console.push(line)
-        
-        return self.output_buffer.getvalue().strip()
-
-    def get_variables(self):
-        # Filter out built-ins and internal names, and ensure they are JSON serializable
-        vars_dict = {}
-        for k, v in self.console.locals.items():
-            if not k.startswith('__'):
-                try:
-                    # Basic check for serializability
-                    import json
-                    json.dumps(v)
-                    vars_dict[k] = v
-                except:
-                    vars_dict[k] = f"<{type(v).__name__} object>"
-        return vars_dict
+    def get_encoded_variables(self, media_type=JSON):
+        # Each value is encoded exactly once, straight into the response format
+        return encode_variables(self._public_variables(), media_type)
 
     def terminate(self):
         pass # No process to kill
@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class SchedulerError(Exception):
+    pass
+
+class QuotaExceeded(SchedulerError):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Tenant:
+    __slots__ = ('weight', 'vtime', 'session_clock', 'queued', 'cpu_time', 'window_start', 'window_cpu',
+                 'last_active')
+
+    def __init__(self, weight):
+        self.weight = weight
+        self.vtime = 0.0  # CPU seconds used, divided by weight
+        self.session_clock = 0.0  # vtime of the last session of this tenant that ran
+        self.queued = 0
+        self.cpu_time = 0.0
+        self.window_start = time.monotonic()
+        self.window_cpu = 0.0
+        self.last_active = self.window_start
+
+class _Session:
+    __slots__ = ('tenant', 'vtime', 'cpu_time', 'executions', 'jobs')
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.vtime = 0.0
+        self.cpu_time = 0.0
+        self.executions = 0
+        self.jobs = {}  # lane -> deque of pending jobs
+
+class ExecutionScheduler:
+    """Weighted fair queue in front of the runtimes.
+
+    Lanes are served in priority order. Within a lane the tenant with the least
+    weighted CPU time goes next, and within that tenant the least-used session.
+    Each job is charged the CPU time it actually consumed once it finishes, so
+    heavy users fall behind light ones without needing a cost estimate up front.
+    Jobs run one at a time on a single thread: the sandbox redirects the
+    process-wide stdout and sets process-wide rlimits.
+    """
+
+    def __init__(self, lanes=("interactive", "batch"), default_lane="batch", tenant_weights=None,
+                 default_weight=1, cpu_quota=0, quota_window=60, max_queued=100):
+        self.lanes = list(lanes)
+        self.default_lane = default_lane
+        self.tenant_weights = dict(tenant_weights or {})
+        self.default_weight = default_weight
+        self.cpu_quota = cpu_quota
+        self.quota_window = quota_window
+        self.max_queued = max_queued
+        self._tenants = {}
+        self._sessions = {}
+        self._backlog = {lane: {} for lane in self.lanes}  # lane -> {session key: _Session}
+        self._virtual_time = 0.0
+        self._next_expiry = time.monotonic() + quota_window
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            lanes=config.get("scheduler", "lanes", ["interactive", "batch"]),
+            default_lane=config.get("scheduler", "default_lane", "batch"),
+            tenant_weights=config.get("scheduler", "tenant_weights", {}),
+            default_weight=float(config.get("scheduler", "default_weight", 1)),
+            cpu_quota=float(config.get("scheduler", "cpu_quota", 0)),
+            quota_window=float(config.get("scheduler", "quota_window", 60)),
+            max_queued=int(config.get("scheduler", "max_queued", 100)),
+        )
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="execution-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit(self, func, tenant_id="default", session_id="default", lane=None, meter=time.thread_time):
+        """Queue func() and return a Future for its result.
+
+        meter returns cumulative CPU seconds; the job is charged the difference
+        between its values before and after func runs.
+        """
+        lane = lane or self.default_lane
+        if lane not in self._backlog:
+            raise SchedulerError(f"Unknown lane: {lane}")
+        future = Future()
+        with self._cond:
+            now = time.monotonic()
+            self._expire_idle_tenants(now)
+            tenant = self._tenants.get(tenant_id)
+            if tenant is None:
+                tenant = self._tenants[tenant_id] = _Tenant(self.tenant_weights.get(tenant_id, self.default_weight))
+            self._check_quota(tenant_id, tenant)
+            tenant.last_active = now
+
+            key = (tenant_id, session_id)
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = _Session(tenant)
+            # An idle flow rejoins at the current virtual time instead of banking credit
+            if tenant.queued == 0:
+                tenant.vtime = max(tenant.vtime, self._virtual_time)
+            if not any(session.jobs.values()):
+                session.vtime = max(session.vtime, tenant.session_clock)
+
+            session.jobs.setdefault(lane, deque()).append((future, func, session, meter))
+            self._backlog[lane][key] = session
+            tenant.queued += 1
+            self._cond.notify()
+        return future
+
+    def _check_quota(self, tenant_id, tenant):
+        now = time.monotonic()
+        if now - tenant.window_start >= self.quota_window:
+            tenant.window_start = now
+            tenant.window_cpu = 0.0
+        if self.cpu_quota and tenant.window_cpu >= self.cpu_quota:
+            retry_after = tenant.window_start + self.quota_window - now
+            raise QuotaExceeded(f"CPU quota exceeded for tenant: {tenant_id}", retry_after)
+        if self.max_queued and tenant.queued >= self.max_queued:
+            raise QuotaExceeded(f"Too many queued executions for tenant: {tenant_id}", 1)
+
+    def _expire_idle_tenants(self, now):
+        # Tenant ids come from clients, so their state must not outlive their use. After a
+        # quota window without jobs a tenant's quota has reset and it would rejoin at the
+        # current virtual time anyway; only its usage totals are lost
+        if now < self._next_expiry:
+            return
+        self._next_expiry = now + self.quota_window
+        idle = {tenant_id for tenant_id, tenant in self._tenants.items()
+                if tenant.queued == 0 and now - tenant.last_active >= self.quota_window}
+        for tenant_id in idle:
+            del self._tenants[tenant_id]
+        for key in [key for key in self._sessions if key[0] in idle]:
+            del self._sessions[key]
+
+    def _next_job(self):
+        for lane in self.lanes:
+            backlog = self._backlog[lane]
+            if not backlog:
+                continue
+            tenant = min((session.tenant for session in backlog.values()), key=lambda t: t.vtime)
+            key, session = min(
+                ((key, session) for key, session in backlog.items() if session.tenant is tenant),
+                key=lambda item: item[1].vtime
+            )
+            jobs = session.jobs[lane]
+            job = jobs.popleft()
+            if not jobs:
+                del backlog[key]
+            tenant.queued -= 1
+            self._virtual_time = tenant.vtime
+            tenant.session_clock = session.vtime
+            return job
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None and not self._stopping:
+                    self._cond.wait()
+                    job = self._next_job()
+                if job is None:
+                    return
+            future, func, session, meter = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = meter()
+            result, error = None, None
+            try:
+                result = func()
+            except BaseException as e:
+                error = e
+            self._charge(session, max(0.0, meter() - start))
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _charge(self, session, cpu_time):
+        with self._cond:
+            tenant = session.tenant
+            tenant.last_active = time.monotonic()
+            tenant.vtime += cpu_time / tenant.weight
+            tenant.cpu_time += cpu_time
+            tenant.window_cpu += cpu_time
+            session.vtime += cpu_time
+            session.cpu_time += cpu_time
+            session.executions += 1
+
+    def forget_session(self, session_id):
+        with self._cond:
+            for key in [key for key in self._sessions if key[1] == session_id]:
+                if not any(self._sessions[key].jobs.values()):
+                    del self._sessions[key]
+
+    def stats(self):
+        with self._cond:
+            tenants = {
+                tenant_id: {
+                    "weight": tenant.weight,
+                    "cpu_time": tenant.cpu_time,
+                    "window_cpu_time": tenant.window_cpu,
+                    "queued": tenant.queued,
+                    "sessions": {},
+                }
+                for tenant_id, tenant in self._tenants.items()
+            }
+            for (tenant_id, session_id), session in self._sessions.items():
+                tenants[tenant_id]["sessions"][session_id] = {
+                    "cpu_time": session.cpu_time,
+                    "executions": session.executions,
+                    "queued": sum(len(jobs) for jobs in session.jobs.values()),
+                }
+            return {"lanes": self.lanes, "tenants": tenants}
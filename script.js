@@ -18,7 +18,7 @@ userInput.addEventListener('keydown', async (e) => {
             const response = await fetch('/api/execute', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ prompt: command })
+                body: JSON.stringify({ prompt: command, lane: 'interactive' })
             });
             const data = await response.json();
             
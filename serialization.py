@@ -0,0 +1,156 @@
+import gzip
+import json
+import math
+from config import config
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack responses are unavailable
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # Only gzip compression is offered
+    zstandard = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+_MSGPACK_TYPES = (MSGPACK, "application/x-msgpack", "application/vnd.msgpack")
+_JSON_TYPES = (JSON, "application/*", "*/*")
+
+if orjson is not None:
+    # Without these orjson encodes datetimes and dataclasses that the stdlib
+    # encoder and msgpack reject, so JSON and msgpack responses would disagree
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+class NotSerializable(Exception):
+    pass
+
+def dumps_json(value) -> bytes:
+    """Encode one value as JSON, raising NotSerializable if it cannot be."""
+    if orjson is not None:
+        try:
+            # Non-string keys are converted like json.dumps does
+            return orjson.dumps(value, option=_ORJSON_OPTIONS)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; let the stdlib decide
+    try:
+        return json.dumps(value).encode()
+    except (TypeError, ValueError, RecursionError):
+        raise NotSerializable(type(value).__name__)
+
+def _json_key(key):
+    # The conversion json.dumps applies to non-string dict keys
+    if isinstance(key, str):
+        return key
+    if isinstance(key, int) and not isinstance(key, bool):
+        return str(key)
+    if key is None or isinstance(key, (bool, float)):
+        return json.dumps(key)
+    raise NotSerializable(type(key).__name__)
+
+def _json_model(value):
+    """Reduce value to what a JSON response would carry, raising NotSerializable like dumps_json."""
+    if value is None or isinstance(value, (str, bool, int)):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, (list, tuple)):
+        return [_json_model(item) for item in value]
+    if isinstance(value, dict):
+        return {_json_key(key): _json_model(item) for key, item in value.items()}
+    raise NotSerializable(type(value).__name__)
+
+def dumps_msgpack(value) -> bytes:
+    """Encode one value as MessagePack under the same rules as dumps_json.
+
+    Bytes and other types JSON rejects are rejected, non-finite floats become
+    nil and dict keys become strings, so both formats carry the same data and
+    plain msgpack.unpackb() can read it.
+    """
+    try:
+        return msgpack.packb(_json_model(value))
+    except (NotSerializable, TypeError, ValueError, OverflowError, RecursionError):
+        raise NotSerializable(type(value).__name__)
+
+def _parse_qvalues(header: str) -> dict:
+    """Map each token of an Accept-style header to its q-value."""
+    qvalues = {}
+    for item in (header or "").split(","):
+        token, *params = [part.strip() for part in item.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[token.lower()] = max(q, qvalues.get(token.lower(), 0.0))
+    return qvalues
+
+def negotiate_media_type(accept: str) -> str:
+    if msgpack is None or not accept:
+        return JSON
+    qvalues = _parse_qvalues(accept)
+    msgpack_q = max(qvalues.get(media_type, 0.0) for media_type in _MSGPACK_TYPES)
+    json_q = max(qvalues.get(media_type, 0.0) for media_type in _JSON_TYPES)
+    # JSON is also the fallback when the client accepts neither
+    return MSGPACK if msgpack_q > 0 and msgpack_q >= json_q else JSON
+
+def negotiate_encoding(accept_encoding: str):
+    qvalues = _parse_qvalues(accept_encoding)
+    candidates = ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+    # Highest q wins, zstd on a tie; q=0 means "not acceptable"
+    encoding = max(candidates, key=lambda name: qvalues.get(name, 0.0))
+    return encoding if qvalues.get(encoding, 0.0) > 0 else None
+
+def encode_variables(variables, media_type=JSON):
+    """Encode each variable once; values that cannot be encoded become a placeholder."""
+    dumps = dumps_msgpack if media_type == MSGPACK else dumps_json
+    encoded = {}
+    for name, value in variables:
+        try:
+            encoded[name] = dumps(value)
+        except NotSerializable as e:
+            encoded[name] = dumps(f"<{e} object>")
+    return encoded
+
+def encode_execute_result(output: str, encoded_variables, media_type=JSON, extra=None) -> bytes:
+    """Build the /api/execute body around already-encoded variable values.
+
+    extra holds further top-level fields with plain, serializable values.
+    """
+    extra = extra or {}
+    if media_type == MSGPACK:
+        packer = msgpack.Packer()
+        parts = [packer.pack_map_header(2 + len(extra)), packer.pack("output"), packer.pack(output),
+                 packer.pack("variables"), packer.pack_map_header(len(encoded_variables))]
+        for name, value in encoded_variables.items():
+            parts.append(packer.pack(name))
+            parts.append(value)
+        for name, value in extra.items():
+            parts.append(packer.pack(name))
+            parts.append(packer.pack(value))
+        return b"".join(parts)
+
+    members = b",".join(dumps_json(name) + b":" + value for name, value in encoded_variables.items())
+    fields = b"".join(b"," + dumps_json(name) + b":" + dumps_json(value) for name, value in extra.items())
+    return b'{"output":' + dumps_json(output) + b',"variables":{' + members + b"}" + fields + b"}"
+
+def compress(body: bytes, encoding):
+    """Compress body with the negotiated encoding if it is large enough; returns (body, encoding)."""
+    if encoding is None or len(body) < config.get("serialization", "compression_threshold", 1024):
+        return body, None
+    if encoding == "zstd":
+        level = config.get("serialization", "zstd_level", 3)
+        return zstandard.ZstdCompressor(level=level).compress(body), encoding
+    level = config.get("serialization", "gzip_level", 6)
+    return gzip.compress(body, compresslevel=level), encoding
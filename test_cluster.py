@@ -0,0 +1,144 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from cluster import ClusterNode, HashRing, Registry, SessionRegistry
+
+class TestHashRing(unittest.TestCase):
+    def test_routing_is_stable(self):
+        ring = HashRing(["w1", "w2", "w3"])
+        self.assertEqual(ring.get("session"), HashRing(["w3", "w1", "w2"]).get("session"))
+
+    def test_join_moves_only_some_sessions(self):
+        ring = HashRing(["w1", "w2", "w3"])
+        before = {f"s{i}": ring.get(f"s{i}") for i in range(1000)}
+        ring.add("w4")
+        moved = [key for key, owner in before.items() if ring.get(key) != owner]
+        # Only sessions claimed by the new worker move
+        self.assertTrue(all(ring.get(key) == "w4" for key in moved))
+        self.assertLess(len(moved), 500)
+
+    def test_remove(self):
+        ring = HashRing(["w1", "w2"])
+        ring.remove("w2")
+        self.assertEqual(ring.get("session"), "w1")
+        ring.remove("w1")
+        self.assertIsNone(ring.get("session"))
+
+class TestClusterNode(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "registry.db")
+        self.released = []
+        self.node_a = ClusterNode(SessionRegistry(self.path), "a", "127.0.0.1:1")
+        self.node_b = ClusterNode(SessionRegistry(self.path), "b", "127.0.0.1:2", on_release=self.released.append)
+        for node in (self.node_a, self.node_b):
+            node.registry.heartbeat(node.worker_id, node.address)
+        for node in (self.node_a, self.node_b):
+            node.refresh()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_nodes_agree_on_owner(self):
+        for i in range(20):
+            session_id = f"s{i}"
+            self.assertEqual(self.node_a.route(session_id), self.node_b.route(session_id))
+
+    def test_sessions_of_departed_worker_are_rehomed(self):
+        owned_by_b = [f"s{i}" for i in range(50) if self.node_b.route(f"s{i}")[0] == "b"]
+        self.assertTrue(owned_by_b)
+
+        self.node_b.registry.remove_worker("b")
+        self.node_a.refresh()
+        for session_id in owned_by_b:
+            self.assertEqual(self.node_a.route(session_id)[0], "a")
+
+    def test_forget_drops_ownership(self):
+        owner, _ = self.node_a.route("evicted")
+        node = self.node_a if owner == "a" else self.node_b
+        node.forget("evicted")
+        self.assertNotIn("evicted", node.local_sessions)
+        self.assertIsNone(node.registry.get_owner("evicted"))
+
+    def test_join_keeps_existing_sessions(self):
+        owners = {f"s{i}": self.node_a.route(f"s{i}")[0] for i in range(50)}
+        node_c = ClusterNode(SessionRegistry(self.path), "c", "127.0.0.1:3")
+        node_c.registry.heartbeat("c", node_c.address)
+        node_c.refresh()
+        self.node_a.refresh()
+        for session_id, owner in owners.items():
+            self.assertEqual(self.node_a.route(session_id)[0], owner)
+            self.assertEqual(node_c.route(session_id)[0], owner)
+
+    def test_concurrent_membership_changes(self):
+        # The heartbeat thread and request threads update the ring at the same time
+        errors = []
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        def churn():
+            try:
+                for _ in range(50):
+                    self.node_a._unreachable.pop("b", None)
+                    self.node_a.refresh()
+                    self.node_a.mark_unreachable("b")
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=churn) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.node_a.ring.nodes, {"a"})
+
+class MemoryRegistry(Registry):
+    """Stand-in for a shared backend, shared by passing the same instance to each node."""
+
+    def __init__(self):
+        self.workers = {}
+        self.sessions = {}
+
+    def heartbeat(self, worker_id, address):
+        self.workers[worker_id] = address
+
+    def remove_worker(self, worker_id):
+        self.workers.pop(worker_id, None)
+        self.release_orphans(list(self.workers))
+
+    def live_workers(self, timeout):
+        return dict(self.workers)
+
+    def get_owner(self, session_id):
+        return self.sessions.get(session_id)
+
+    def claim(self, session_id, worker_id, previous_owner=None):
+        if self.sessions.get(session_id) == previous_owner:
+            self.sessions[session_id] = worker_id
+        return self.sessions[session_id]
+
+    def release(self, session_id, worker_id):
+        if self.sessions.get(session_id) == worker_id:
+            del self.sessions[session_id]
+
+    def release_orphans(self, live_worker_ids):
+        orphans = [session_id for session_id, owner in self.sessions.items() if owner not in live_worker_ids]
+        for session_id in orphans:
+            del self.sessions[session_id]
+        return orphans
+
+class TestRegistryBackend(unittest.TestCase):
+    def test_nodes_share_a_custom_backend(self):
+        registry = MemoryRegistry()
+        nodes = [ClusterNode(registry, worker_id, f"10.0.0.{i}:8000") for i, worker_id in enumerate("ab", 1)]
+        for node in nodes:
+            registry.heartbeat(node.worker_id, node.address)
+        for node in nodes:
+            node.refresh()
+        owners = {f"s{i}": nodes[0].route(f"s{i}")[0] for i in range(20)}
+        self.assertEqual(set(owners.values()), {"a", "b"})
+        self.assertEqual(owners, {session_id: nodes[1].route(session_id)[0] for session_id in owners})
+
+if __name__ == "__main__":
+    unittest.main()
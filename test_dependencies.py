@@ -0,0 +1,65 @@
+import ast
+import unittest
+from dependencies import DependencyGraph, analyze
+
+def names(source):
+    defines, uses = analyze(ast.parse(source))
+    return set(defines), set(uses)
+
+class TestAnalyze(unittest.TestCase):
+    def test_assignments(self):
+        self.assertEqual(names("y = x * 2"), ({"y"}, {"x"}))
+        self.assertEqual(names("a = 1\nb = a + 1"), ({"a", "b"}, set()))
+        self.assertEqual(names("total += step"), ({"total"}, {"total", "step"}))
+
+    def test_functions(self):
+        defines, uses = names("def scale(v, factor=k):\n    local = v * ratio\n    return local")
+        self.assertEqual(defines, {"scale"})
+        self.assertEqual(uses, {"k", "ratio"})
+
+    def test_lambdas_and_comprehensions(self):
+        defines, uses = names("f = lambda n: n + offset\nsquares = [i * i for i in data if i > limit]")
+        self.assertEqual(defines, {"f", "squares"})
+        self.assertEqual(uses, {"offset", "data", "limit"})
+
+    def test_imports_and_globals(self):
+        defines, uses = names("import math\nfrom statistics import mean\ndef reset():\n    global count\n    count = 0")
+        self.assertEqual(defines, {"math", "mean", "reset", "count"})
+        self.assertEqual(uses, set())
+
+class TestDependencyGraph(unittest.TestCase):
+    def add(self, graph, source):
+        return graph.add(source, *analyze(ast.parse(source)))
+
+    def test_redefinition_replaces_block(self):
+        graph = DependencyGraph()
+        first = self.add(graph, "x = 1")
+        dependent = self.add(graph, "y = x + 1")
+        redefined = self.add(graph, "x = 2")
+        self.assertEqual(graph.blocks, [redefined, dependent])
+        self.assertNotIn(first, graph.blocks)
+        self.assertEqual(graph.downstream(redefined), [dependent])
+
+    def test_partial_redefinition_runs_after_definer(self):
+        graph = DependencyGraph()
+        loader = self.add(graph, "data = [1, 2]\nn = len(data)")
+        dependent = self.add(graph, "m = sum(data)")
+        redefined = self.add(graph, "data = [3]")
+        self.assertEqual(graph.blocks, [loader, redefined, dependent])
+
+    def test_new_block_is_last_writer(self):
+        graph = DependencyGraph()
+        first = self.add(graph, "x = 1\na = 1")
+        second = self.add(graph, "x = 5\nb = 2")
+        dependent = self.add(graph, "y = x + 1")
+        redefined = self.add(graph, "x = 2")
+        self.assertEqual(graph.blocks, [first, second, redefined, dependent])
+
+    def test_history_is_bounded(self):
+        graph = DependencyGraph(max_blocks=3)
+        for i in range(5):
+            self.add(graph, f"v{i} = {i}")
+        self.assertEqual(len(graph.blocks), 3)
+
+if __name__ == "__main__":
+    unittest.main()
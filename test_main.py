@@ -0,0 +1,182 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import urllib.request
+from fastapi.testclient import TestClient
+import main
+from cluster import FORWARDED_HEADER
+from config import config
+
+class TestExecuteAPI(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        for session_id in [session_id for session_id in main.sessions if session_id != "default"]:
+            main.release_session(session_id)
+
+    def execute(self, prompt, **fields):
+        return self.client.post("/api/execute", json={"prompt": prompt, **fields})
+
+    def test_execute(self):
+        response = self.execute("x = 6\nprint(x * 7)", session_id="api")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["output"], "42")
+        self.assertEqual(response.json()["variables"], {"x": 6})
+
+    def test_sessions_are_capped(self):
+        config.update("limits", "max_sessions", 3)
+        try:
+            for i in range(5):
+                self.assertEqual(self.execute(f"n = {i}", session_id=f"s{i}").status_code, 200)
+            self.assertLessEqual(len(main.sessions), 3)
+            self.assertNotIn("s0", main.sessions)
+            self.assertFalse(any(key[1] == "s0" for key in main.scheduler._sessions))
+            # An evicted session starts fresh
+            self.assertIn("not defined", self.execute("print(n)", session_id="s0").json()["output"])
+        finally:
+            config.update("limits", "max_sessions", 1000)
+
+    def test_idle_sessions_are_evicted(self):
+        self.execute("n = 1", session_id="idle")
+        for session_id in main.session_last_used:
+            main.session_last_used[session_id] -= config.get("limits", "session_idle_timeout", 3600)
+        self.execute("n = 2", session_id="active")
+        self.assertNotIn("idle", main.sessions)
+        self.assertIn("active", main.sessions)
+
+class TestSchedulingAPI(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.cpu_quota = main.scheduler.cpu_quota
+        main.scheduler.cpu_quota = 1e-9
+        main.scheduler._tenants.clear()
+
+    def tearDown(self):
+        main.scheduler.cpu_quota = self.cpu_quota
+        main.scheduler._tenants.clear()
+        config.update("scheduler", "trusted_clients", ["127.0.0.1", "::1"])
+        self.client.__exit__(None, None, None)
+        main.release_session("quota")
+
+    def execute(self, tenant_id, lane="interactive"):
+        return self.client.post(
+            "/api/execute", json={"prompt": "print(1)", "session_id": "quota", "tenant_id": tenant_id, "lane": lane}
+        )
+
+    def test_quota_returns_429(self):
+        self.assertEqual(self.execute("tenant-0").status_code, 200)
+        # Fresh tenant ids from an untrusted client are still accounted to its address
+        response = self.execute("tenant-1")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response.headers)
+        self.assertEqual(list(main.scheduler.stats()["tenants"]), ["client:testclient"])
+        # and its lane is ignored rather than validated
+        self.assertEqual(self.execute("tenant-2", lane="express").status_code, 429)
+
+    def test_rejected_request_does_not_evict(self):
+        config.update("limits", "max_sessions", len(main.sessions))
+        try:
+            self.assertEqual(self.execute("tenant-0").status_code, 200)
+            sessions = list(main.sessions)
+            response = self.client.post("/api/execute", json={"prompt": "print(1)", "session_id": "rejected"})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(list(main.sessions), sessions)
+        finally:
+            config.update("limits", "max_sessions", 1000)
+
+    def test_trusted_client_chooses_tenant(self):
+        config.update("scheduler", "trusted_clients", ["testclient"])
+        self.assertEqual(self.execute("tenant-0").status_code, 200)
+        self.assertEqual(self.execute("tenant-0").status_code, 429)
+        self.assertEqual(self.execute("tenant-1").status_code, 200)
+        self.assertEqual(self.execute("tenant-2", lane="express").status_code, 400)
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class TestClusterForwarding(unittest.TestCase):
+    """Node A runs in-process behind a TestClient; node B is a separate server process."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        registry_path = os.path.join(self.tmpdir.name, "registry.db")
+        self.port_b = _free_port()
+        env = dict(
+            os.environ, CLUSTER_ENABLED="true", CLUSTER_REGISTRY_PATH=registry_path,
+            APP_HOST="127.0.0.1", APP_PORT=str(self.port_b), APP_LOG_LEVEL="WARNING"
+        )
+        self.node_b = subprocess.Popen(
+            [sys.executable, "main.py"], cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self._wait_for_node_b()
+
+        self.saved = dict(config.get("cluster"))
+        config.update("cluster", "enabled", True)
+        config.update("cluster", "registry_path", registry_path)
+        config.update("cluster", "advertise_port", _free_port())
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.worker_b = f"127.0.0.1:{self.port_b}"
+        self.session_id = next(f"s{i}" for i in range(1000) if main.cluster.ring.get(f"s{i}") == self.worker_b)
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        main.cluster = None
+        config.settings["cluster"] = self.saved
+        main.release_session(self.session_id)
+        self.node_b.kill()
+        self.node_b.wait()
+        self.tmpdir.cleanup()
+
+    def _wait_for_node_b(self):
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port_b}/api/cluster", timeout=1):
+                    return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def execute(self, prompt, headers=None):
+        return self.client.post(
+            "/api/execute", json={"prompt": prompt, "session_id": self.session_id}, headers=headers or {}
+        )
+
+    def test_forwards_to_owner(self):
+        self.assertEqual(self.execute("x = 7").status_code, 200)
+        response = self.execute("print(x)")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["output"], "7")
+        self.assertNotIn(self.session_id, main.sessions)
+
+    def test_forwarded_header_from_client_is_ignored(self):
+        self.execute("x = 7")
+        response = self.execute("print(x)", headers={FORWARDED_HEADER: self.worker_b})
+        self.assertEqual(response.json()["output"], "7")
+        self.assertNotIn(self.session_id, main.sessions)
+
+    def test_dead_owner_is_rerouted(self):
+        self.execute("x = 7")
+        # Killed without deregistering, so its heartbeat is still within worker_timeout
+        self.node_b.kill()
+        self.node_b.wait()
+        response = self.execute("print(x)")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("not defined", response.json()["output"])
+        self.assertIn(self.session_id, main.sessions)
+
+if __name__ == "__main__":
+    unittest.main()
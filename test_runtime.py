@@ -1,6 +1,10 @@
+import resource
+import sys
 import unittest
 import time
-from runtime import PythonRuntime, SandboxError
+from unittest import mock
+from config import config
+from runtime import PythonRuntime, SandboxError, get_shared_module
 
 class TestPythonRuntime(unittest.TestCase):
     def setUp(self):
@@ -79,6 +83,250 @@ class TestPythonRuntime(unittest.TestCase):
         result = self.runtime.execute("_private = 10")
         self.assertIn("Security Error", result)
 
+    def test_allowed_imports(self):
+        result = self.runtime.execute("import math\nprint(math.sqrt(16))")
+        self.assertIn("4.0", result)
+
+        result = self.runtime.execute("from statistics import mean\nprint(mean([1, 2, 3]))")
+        self.assertIn("2", result)
+
+    def test_disallowed_imports(self):
+        result = self.runtime.execute("import socket")
+        self.assertIn("not allowed", result)
+
+        # Submodules of allowed modules are not a way around the allowlist
+        result = self.runtime.execute("import statistics\nprint(statistics.sys)")
+        self.assertIn("not allowed", result)
+
+    def test_submodules_must_be_listed(self):
+        result = self.runtime.execute("import json.tool")
+        self.assertIn("not allowed", result)
+        result = self.runtime.execute("from json import tool")
+        self.assertIn("Runtime Error", result)
+
+    def test_system_exit_stays_in_the_sandbox(self):
+        allowed = config.get("security", "allowed_imports")
+        config.update("security", "allowed_imports", allowed + ["json.tool"])
+        try:
+            with mock.patch.object(sys, "argv", ["json.tool", "--unknown-option"]):
+                result = self.runtime.execute("import json.tool\njson.tool.main()")
+        finally:
+            config.update("security", "allowed_imports", allowed)
+        self.assertIn("SystemExit", result)
+        self.assertIn("2", self.runtime.execute("print(1 + 1)"))
+
+    def test_allowlist_escapes(self):
+        # Each of these reaches the host's real builtins or the file system when allowed
+        escapes = [
+            "import operator, json\n"
+            "print(operator.attrgetter('__globals__')(json.loads)['__builtins__']['__import__']('o'+'s').getcwd())",
+            "import string, json\n"
+            "print(string.Formatter().get_field('0.__globals__', (json.loads,), {})[0]['__builtins__'])",
+            "import numpy\nprint(numpy.fromfile)",
+            "import functools, json\nf = lambda: 1\n"
+            "functools.update_wrapper(f, json.loads, assigned=(), updated=('__globals__',))",
+        ]
+        for code in escapes:
+            result = self.runtime.execute(code)
+            self.assertIn("not allowed", result)
+        result = self.runtime.execute("print(open)")
+        self.assertNotIn("built-in", result)
+
+    def test_sandbox_internals_are_protected(self):
+        result = self.runtime.execute("__builtins__ = {}")
+        self.assertIn("Security Error", result)
+        self.assertIn("__import__", self.runtime.environment.locals["__builtins__"])
+
+        result = self.runtime.execute("def f():\n    global __loader__\n    __loader__ = 1\nf()")
+        self.assertIn("Security Error", result)
+        self.assertNotIn("__loader__", self.runtime.environment.locals)
+
+    def test_shared_modules_are_read_only(self):
+        result = self.runtime.execute("import math\nmath.pi = 3")
+        self.assertIn("read-only", result)
+
+        result = self.runtime.execute("print(math.__dict__)")
+        self.assertIn("Security Error", result)
+
+    def test_shared_objects_are_read_only(self):
+        import collections
+        result = self.runtime.execute("import collections\ncollections.Counter.most_common = None")
+        self.assertIn("read-only", result)
+        self.assertIsNotNone(collections.Counter.most_common)
+
+        # Registering a virtual subclass would change isinstance() for the whole worker
+        import fractions
+        result = self.runtime.execute("import fractions\nfractions.Fraction.register(list)")
+        self.assertIn("read-only", result)
+        self.assertFalse(isinstance([], fractions.Fraction))
+
+        result = self.runtime.execute("import collections\ncollections.UserDict.register(int)")
+        self.assertIn("read-only", result)
+
+    def test_sandbox_objects_are_writable(self):
+        code = (
+            "class P:\n    def __init__(self, x):\n        self.x = x\n"
+            "p = P(1)\np.x += 1\nP.label = 'point'\nprint(p.x, p.label)"
+        )
+        self.assertIn("2 point", self.runtime.execute(code))
+
+        # Subclasses of shared classes are the session's own, their bases are not
+        result = self.runtime.execute("import collections\nclass C(collections.Counter):\n    pass\nc = C()\nc.tag = 1")
+        self.assertNotIn("Error", result)
+        result = self.runtime.execute("collections.Counter().tag = 1")
+        self.assertIn("read-only", result)
+
+        result = self.runtime.execute("print(__sandbox_attributes__(p)['__class__'])")
+        self.assertIn("Security Error", result)
+
+    def test_random_state_per_session(self):
+        import random
+        other = PythonRuntime()
+        host_state = random.getstate()
+        self.runtime.execute("import random\nrandom.seed(42)\nfirst = random.random()")
+        other.execute("import random\nrandom.seed(7)\nfrom random import random as draw\nvalue = draw()")
+        self.runtime.execute("second = random.random()")
+        expected = random.Random(42)
+        self.assertEqual(self.runtime.get_variables()["first"], expected.random())
+        self.assertEqual(self.runtime.get_variables()["second"], expected.random())
+        self.assertEqual(other.get_variables()["value"], random.Random(7).random())
+        self.assertEqual(random.getstate(), host_state)
+
+        result = self.runtime.execute("import statistics\nstatistics.random.seed(1)")
+        self.assertIn("Security Error", result)
+
+    def test_decimal_not_allowed_by_default(self):
+        # DefaultContext is worker-wide state no session may change
+        result = self.runtime.execute("import decimal")
+        self.assertIn("not allowed", result)
+
+    def test_decimal_context_per_session(self):
+        allowed = config.get("security", "allowed_imports")
+        config.update("security", "allowed_imports", allowed + ["decimal"])
+        self.addCleanup(config.update, "security", "allowed_imports", allowed)
+        other = PythonRuntime()
+        self.runtime.execute("import decimal\ndecimal.setcontext(decimal.Context(prec=5))")
+        other.execute("import decimal\nwide = str(decimal.Decimal(1) / decimal.Decimal(3))")
+        self.runtime.execute("narrow = str(decimal.Decimal(1) / decimal.Decimal(3))")
+        self.assertEqual(self.runtime.get_variables()["narrow"], "0.33333")
+        self.assertEqual(len(other.get_variables()["wide"]), 30)
+
+    def test_shared_modules_across_sessions(self):
+        other = PythonRuntime()
+        self.runtime.execute("import json")
+        other.execute("import json")
+        self.assertIs(self.runtime.environment["json"], other.environment["json"])
+        self.assertIs(self.runtime.environment["json"], get_shared_module("json"))
+
+    def test_execution_budget_loops(self):
+        self.runtime.max_execution_steps = 1000
+        result = self.runtime.execute("print('start')\nwhile True:\n    pass")
+        self.assertIn("start", result)
+        self.assertIn("Budget Error", result)
+
+        result = self.runtime.execute("total = sum(i for i in range(5000))")
+        self.assertIn("Budget Error", result)
+
+    def test_execution_budget_function_calls(self):
+        self.runtime.max_execution_steps = 1000
+        result = self.runtime.execute("def f(n):\n    return 1 if n < 2 else f(n - 1) + f(n - 2)\nprint(f(20))")
+        self.assertIn("Budget Error", result)
+
+        # The budget is reset for every execution
+        result = self.runtime.execute("print(f(5))")
+        self.assertIn("8", result)
+
+    def test_execution_budget_is_deterministic(self):
+        self.runtime.max_execution_steps = 100
+        counts = []
+        for _ in range(2):
+            result = self.runtime.execute("count = 0\nfor i in range(1000):\n    count = count + 1")
+            self.assertIn("Budget Error", result)
+            counts.append(self.runtime.get_variables()["count"])
+        self.assertEqual(counts[0], counts[1])
+        self.assertLess(counts[0], 110)
+
+    def test_execution_budget_not_hidden_by_iterators(self):
+        # A check failing inside map() must not pass for a short result
+        self.runtime.max_execution_steps = 100
+        result = self.runtime.execute("f = lambda n: n\nvalues = list(map(f, range(1000)))")
+        self.assertIn("Budget Error", result)
+
+        result = self.runtime.execute("def g():\n    for i in range(1000):\n        yield i\ntotal = sum(g())")
+        self.assertIn("Budget Error", result)
+
+    def test_within_budget(self):
+        self.runtime.max_execution_steps = 100
+        result = self.runtime.execute("print(sum([i for i in range(50)]))")
+        self.assertIn("1225", result)
+
+    def test_resource_limits_are_restored(self):
+        limits = [resource.getrlimit(limit) for limit in (resource.RLIMIT_CPU, resource.RLIMIT_AS)]
+        self.runtime.execute("x = 1")
+        self.runtime.execute("1/0")
+        self.assertEqual([resource.getrlimit(limit) for limit in (resource.RLIMIT_CPU, resource.RLIMIT_AS)], limits)
+
+    def test_builtin_loops_are_metered(self):
+        result = self.runtime.execute("x = sum(range(10 ** 11))")
+        self.assertIn("Budget Error", result)
+        result = self.runtime.execute("print(max(3, 4), min([2, 1]), sum([1, 2], 10), all([]))")
+        self.assertIn("4 1 13 True", result)
+
+    def test_cpu_limit_stops_only_the_execution(self):
+        self.runtime.max_execution_steps = 10 ** 12
+        self.runtime.max_execution_time = 1
+        result = self.runtime.execute("while True:\n    pass")
+        self.assertIn("CPU time limit exceeded", result)
+        self.assertIn("2", self.runtime.execute("print(1 + 1)"))
+
+    def test_execution_budget_reserved_names(self):
+        result = self.runtime.execute("__budget__ = 10 ** 12")
+        self.assertIn("Security Error", result)
+
+    def test_rerun_dependents(self):
+        self.runtime.execute("x = 10")
+        self.runtime.execute("y = x * 2")
+        self.runtime.execute("z = 5")
+        self.runtime.execute("w = y + z\nprint(w)")
+
+        report = self.runtime.rerun_dependents("x = 20")
+        self.assertEqual([item["output"] for item in report["reran"]], ["", "45"])
+        self.assertEqual(len(report["skipped"]), 1)
+        variables = self.runtime.get_variables()
+        self.assertEqual(variables["y"], 40)
+        self.assertEqual(variables["w"], 45)
+
+    def test_rerun_dependents_keeps_submitted_value(self):
+        self.runtime.execute("x = 1\na = 1")
+        self.runtime.execute("y = x + 1")
+        self.runtime.rerun_dependents("x = 5\nb = 2")
+        self.assertEqual(self.runtime.get_variables()["y"], 6)
+
+        # Both earlier definers also define other names, so this block goes after
+        # them and neither is re-run to undo the value just submitted
+        report = self.runtime.rerun_dependents("x = 2")
+        variables = self.runtime.get_variables()
+        self.assertEqual(variables["x"], 2)
+        self.assertEqual(variables["y"], 3)
+        self.assertEqual(len(report["reran"]), 1)
+        self.assertEqual(len(report["skipped"]), 2)
+
+    def test_rerun_dependents_failed_block(self):
+        self.runtime.execute("x = 1")
+        self.runtime.execute("y = x + 1")
+        report = self.runtime.rerun_dependents("x = 1/0")
+        self.assertIn("Runtime Error", report["output"])
+        self.assertIsNone(report["block"])
+        self.assertEqual(report["reran"], [])
+        self.assertEqual(len(self.runtime.graph.blocks), 2)
+
+    def test_rerun_dependents_rejected_block(self):
+        self.runtime.execute("x = 1")
+        report = self.runtime.rerun_dependents("import os")
+        self.assertIn("Security Error", report["output"])
+        self.assertIsNone(report["block"])
+        self.assertEqual(report["reran"], [])
+
 if __name__ == "__main__":
     unittest.main()
 def test_persistence():
@@ -0,0 +1,118 @@
+import time
+import unittest
+from scheduler import ExecutionScheduler, QuotaExceeded, SchedulerError
+
+class FakeCPU:
+    """Meter whose reading only advances when a job says it used CPU."""
+
+    def __init__(self):
+        self.used = 0.0
+
+    def __call__(self):
+        return self.used
+
+class TestExecutionScheduler(unittest.TestCase):
+    def setUp(self):
+        self.cpu = FakeCPU()
+        self.order = []
+        self.scheduler = ExecutionScheduler(max_queued=0)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def job(self, name, cost):
+        def run():
+            self.order.append(name)
+            self.cpu.used += cost
+            return name
+        return run
+
+    def submit(self, name, cost=1.0, **kwargs):
+        return self.scheduler.submit(self.job(name, cost), meter=self.cpu, **kwargs)
+
+    def run_all(self, futures):
+        self.scheduler.start()
+        return [future.result(timeout=5) for future in futures]
+
+    def test_light_tenant_overtakes_heavy_backlog(self):
+        # The heavy tenant has already used CPU; its backlog waits behind the light tenant
+        self.scheduler.start()
+        self.submit("warmup", 10.0, tenant_id="heavy").result(timeout=5)
+        self.scheduler.stop()
+
+        futures = [self.submit(f"heavy-{i}", 10.0, tenant_id="heavy") for i in range(3)]
+        futures.append(self.submit("light", 0.1, tenant_id="light"))
+        self.run_all(futures)
+        self.assertEqual(self.order[1], "light")
+
+    def test_weights_share_cpu(self):
+        self.scheduler.tenant_weights = {"big": 3}
+        futures = []
+        for i in range(8):
+            futures.append(self.submit(f"big-{i}", tenant_id="big"))
+            futures.append(self.submit(f"small-{i}", tenant_id="small"))
+        self.run_all(futures)
+        first = self.order[:8]
+        self.assertEqual(sum(name.startswith("big") for name in first), 6)
+
+    def test_sessions_within_tenant_alternate(self):
+        futures = [self.submit(f"a-{i}", session_id="a") for i in range(3)]
+        futures += [self.submit(f"b-{i}", session_id="b") for i in range(3)]
+        self.run_all(futures)
+        self.assertEqual(self.order, ["a-0", "b-0", "a-1", "b-1", "a-2", "b-2"])
+
+    def test_interactive_lane_first(self):
+        futures = [self.submit(f"batch-{i}", lane="batch") for i in range(3)]
+        futures.append(self.submit("dashboard", lane="interactive"))
+        self.run_all(futures)
+        self.assertEqual(self.order[0], "dashboard")
+
+    def test_unknown_lane(self):
+        with self.assertRaises(SchedulerError):
+            self.submit("job", lane="bulk")
+
+    def test_cpu_quota(self):
+        self.scheduler.cpu_quota = 2.0
+        self.run_all([self.submit("first", 2.5, tenant_id="t")])
+        with self.assertRaises(QuotaExceeded) as ctx:
+            self.submit("second", tenant_id="t")
+        self.assertGreater(ctx.exception.retry_after, 0)
+        # Other tenants are unaffected
+        self.assertEqual(self.submit("other", tenant_id="u").result(timeout=5), "other")
+
+    def test_max_queued(self):
+        self.scheduler.max_queued = 2
+        self.submit("a")
+        self.submit("b")
+        with self.assertRaises(QuotaExceeded):
+            self.submit("c")
+
+    def test_cpu_time_per_session(self):
+        self.run_all([
+            self.submit("a", 1.5, session_id="a"),
+            self.submit("b", 0.5, session_id="b"),
+            self.submit("a2", 1.0, session_id="a"),
+        ])
+        stats = self.scheduler.stats()["tenants"]["default"]
+        self.assertEqual(stats["cpu_time"], 3.0)
+        self.assertEqual(stats["sessions"]["a"]["cpu_time"], 2.5)
+        self.assertEqual(stats["sessions"]["a"]["executions"], 2)
+        self.assertEqual(stats["sessions"]["b"]["cpu_time"], 0.5)
+
+    def test_idle_tenants_expire(self):
+        self.scheduler = ExecutionScheduler(quota_window=0.05)
+        self.run_all([self.submit(f"job-{i}", 0.1, tenant_id=f"t{i}") for i in range(3)])
+        time.sleep(0.1)
+        self.submit("fresh", 0.1, tenant_id="fresh").result(timeout=5)
+        self.assertEqual(list(self.scheduler.stats()["tenants"]), ["fresh"])
+
+    def test_errors_propagate(self):
+        def fail():
+            raise ValueError("boom")
+        future = self.scheduler.submit(fail)
+        self.scheduler.start()
+        with self.assertRaises(ValueError):
+            future.result(timeout=5)
+
+if __name__ == "__main__":
+    unittest.main()
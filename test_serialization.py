@@ -0,0 +1,85 @@
+import gzip
+import json
+import unittest
+from runtime import PythonRuntime
+from serialization import (
+    JSON, MSGPACK, compress, encode_execute_result, msgpack, negotiate_encoding, negotiate_media_type
+)
+
+class TestSerialization(unittest.TestCase):
+    def setUp(self):
+        self.runtime = PythonRuntime()
+        self.runtime.execute("x = 10\nname = 'olla'\nitems = [1, 2.5, None]\nmapping = {1: 'a'}\nf = lambda: 1")
+
+    def tearDown(self):
+        self.runtime.terminate()
+
+    def test_json_matches_variables(self):
+        body = encode_execute_result("out", self.runtime.get_encoded_variables(JSON), JSON)
+        decoded = json.loads(body)
+        self.assertEqual(decoded["output"], "out")
+        self.assertEqual(decoded["variables"], json.loads(json.dumps(self.runtime.get_variables())))
+        self.assertEqual(decoded["variables"]["f"], "<function object>")
+
+    def test_msgpack(self):
+        if msgpack is None:
+            self.skipTest("msgpack is not installed")
+        body = encode_execute_result("out", self.runtime.get_encoded_variables(MSGPACK), MSGPACK)
+        decoded = msgpack.unpackb(body)
+        self.assertEqual(decoded["output"], "out")
+        self.assertEqual(decoded["variables"]["items"], [1, 2.5, None])
+        self.assertEqual(decoded["variables"]["f"], "<function object>")
+
+    def test_negotiation(self):
+        self.assertEqual(negotiate_media_type(None), JSON)
+        self.assertEqual(negotiate_media_type("application/json"), JSON)
+        if msgpack is not None:
+            self.assertEqual(negotiate_media_type("application/msgpack"), MSGPACK)
+        self.assertEqual(negotiate_encoding("gzip, deflate"), "gzip")
+        self.assertIsNone(negotiate_encoding("identity"))
+        self.assertIsNone(negotiate_encoding(None))
+
+    def test_negotiation_qvalues(self):
+        self.assertIsNone(negotiate_encoding("gzip;q=0"))
+        self.assertIsNone(negotiate_encoding("gzip; q=0.0, zstd;q=0"))
+        self.assertEqual(negotiate_encoding("zstd;q=0, gzip;q=0.5"), "gzip")
+        self.assertEqual(negotiate_media_type("application/msgpack;q=0"), JSON)
+        self.assertEqual(negotiate_media_type("application/msgpack;q=0.5, application/json"), JSON)
+        if msgpack is not None:
+            self.assertEqual(negotiate_media_type("application/json;q=0.5, application/msgpack"), MSGPACK)
+
+    def test_datetime_placeholder_in_both_formats(self):
+        self.runtime.execute("import datetime\nwhen = datetime.datetime(2024, 1, 2)")
+        body = encode_execute_result("", self.runtime.get_encoded_variables(JSON), JSON)
+        self.assertEqual(json.loads(body)["variables"]["when"], "<datetime object>")
+        if msgpack is not None:
+            body = encode_execute_result("", self.runtime.get_encoded_variables(MSGPACK), MSGPACK)
+            decoded = msgpack.unpackb(body)
+            self.assertEqual(decoded["variables"]["when"], "<datetime object>")
+
+    def test_msgpack_follows_json_rules(self):
+        if msgpack is None:
+            self.skipTest("msgpack is not installed")
+        self.runtime.execute(
+            "raw = b'data'\nmissing = float('nan')\npairs = {(1, 2): 3}\nkeys = {1: 'a', None: [float('inf')], True: 1.5}"
+        )
+        json_body = encode_execute_result("", self.runtime.get_encoded_variables(JSON), JSON)
+        msgpack_body = encode_execute_result("", self.runtime.get_encoded_variables(MSGPACK), MSGPACK)
+        variables = msgpack.unpackb(msgpack_body)["variables"]
+        self.assertEqual(variables, json.loads(json_body)["variables"])
+        self.assertEqual(variables["raw"], "<bytes object>")
+        self.assertEqual(variables["pairs"], "<dict object>")
+        self.assertIsNone(variables["missing"])
+
+    def test_compression_threshold(self):
+        small = b'{"output":""}'
+        self.assertEqual(compress(small, "gzip"), (small, None))
+
+        large = json.dumps({"values": list(range(2000))}).encode()
+        body, encoding = compress(large, "gzip")
+        self.assertEqual(encoding, "gzip")
+        self.assertEqual(gzip.decompress(body), large)
+        self.assertLess(len(body), len(large))
+
+if __name__ == "__main__":
+    unittest.main()